@@ -0,0 +1,84 @@
+import logging
+import math
+import random
+
+from django.core.cache import caches
+from django.db.models import Count, Max
+from django.db.models.functions import Left
+from django.utils.connection import ConnectionProxy
+
+from blog.models import Post
+from config.settings import CACHE_TTL, CACHE_ENABLED, CACHE_SERVICES
+
+logger = logging.getLogger(__name__)
+
+cache = ConnectionProxy(caches, CACHE_SERVICES)
+
+POST_RANGE_KEY = 'post_id_range'
+
+# Cards show the first 20 words of a post, which fit in this many characters
+EXCERPT_LENGTH = 500
+
+# Random ids are probed in up to SAMPLE_ROUNDS queries of at most
+# SAMPLE_PROBES ids each, twice as many as the share of ids in use needs
+SAMPLE_ROUNDS = 3
+SAMPLE_PROBES = 100
+
+
+def get_post_range():
+    """Number of posts and their highest id, cached until a post is created or deleted."""
+    if not CACHE_ENABLED:
+        return count_posts()
+
+    post_range = cache.get(POST_RANGE_KEY)
+    if post_range is not None:
+        return post_range
+
+    logger.debug("Cache miss for key: %s", POST_RANGE_KEY)
+    post_range = count_posts()
+    cache.set(POST_RANGE_KEY, post_range, timeout=CACHE_TTL)
+    return post_range
+
+
+def count_posts():
+    stats = Post.objects.aggregate(count=Count('id'), max_id=Max('id'))
+    return stats['count'], stats['max_id'] or 0
+
+
+def invalidate_post_range():
+    if CACHE_ENABLED:
+        cache.delete(POST_RANGE_KEY)
+
+
+def card_posts():
+    return Post.objects.only('id', 'title', 'preview').annotate(excerpt=Left('content', EXCERPT_LENGTH))
+
+
+def sample_posts(k):
+    """
+    Up to ``k`` random posts for cards, read without loading every id:
+    random ids up to the highest one are probed and those that exist are
+    kept. If deleted posts leave too many gaps, the rest are taken as the
+    first post at or after a random id.
+    """
+    count, max_id = get_post_range()
+    k = min(k, count)
+    chosen = {}
+    for _ in range(SAMPLE_ROUNDS):
+        missing = k - len(chosen)
+        if missing <= 0:
+            break
+        probes = min(max_id, SAMPLE_PROBES, math.ceil(missing * max_id / count * 2))
+        ids = [pk for pk in random.sample(range(1, max_id + 1), probes) if pk not in chosen]
+        posts = {post.pk: post for post in card_posts().filter(pk__in=ids)}
+        for pk in ids:
+            if pk in posts and len(chosen) < k:
+                chosen[pk] = posts[pk]
+    while len(chosen) < k:
+        remaining = card_posts().exclude(pk__in=chosen).order_by('pk')
+        post = remaining.filter(pk__gte=random.randint(1, max_id)).first() or remaining.first()
+        # Posts deleted since the count was cached
+        if post is None:
+            break
+        chosen[post.pk] = post
+    return list(chosen.values())
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from blog.models import Post
+from blog.services import invalidate_post_range
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, created, **kwargs):
+    # Views are counted with a save on every read, which leaves the count alone
+    if created:
+        invalidate_post_range()
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, **kwargs):
+    invalidate_post_range()
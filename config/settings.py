@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.0/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
+import json
 import os
 from pathlib import Path
 
@@ -150,6 +151,95 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS') == 'True'
 EMAIL_USE_SSL = os.getenv('EMAIL_USE_SSL') == 'True'
 
+# 0 keeps one SMTP connection for the whole newsletter run,
+# N > 0 reopens it after every N messages
+NEWSLETTER_CONNECTION_BATCH = int(os.getenv('NEWSLETTER_CONNECTION_BATCH', 0))
+
+# Attempt rows are written in bulk every N rows or every N seconds
+NEWSLETTER_ATTEMPT_BATCH_SIZE = int(os.getenv('NEWSLETTER_ATTEMPT_BATCH_SIZE', 1000))
+NEWSLETTER_ATTEMPT_FLUSH_INTERVAL = float(os.getenv('NEWSLETTER_ATTEMPT_FLUSH_INTERVAL', 5))
+
+# Number of sending threads, each with its own SMTP connection (1 sends inline),
+# size of the queue feeding them and how many of them may talk to one
+# recipient domain at a time (0 for no limit)
+NEWSLETTER_WORKERS = int(os.getenv('NEWSLETTER_WORKERS', 1))
+NEWSLETTER_QUEUE_SIZE = int(os.getenv('NEWSLETTER_QUEUE_SIZE', 1000))
+NEWSLETTER_DOMAIN_CONCURRENCY = int(os.getenv('NEWSLETTER_DOMAIN_CONCURRENCY', 0))
+
+# Recipients are streamed from the database in chunks of this size
+NEWSLETTER_RECIPIENT_CHUNK_SIZE = int(os.getenv('NEWSLETTER_RECIPIENT_CHUNK_SIZE', 2000))
+
+# Transient delivery failures are retried after RETRY_BASE_DELAY * 2 ** retries
+# seconds (with jitter), never waiting longer than RETRY_MAX_DELAY
+NEWSLETTER_RETRY_BASE_DELAY = float(os.getenv('NEWSLETTER_RETRY_BASE_DELAY', 60))
+NEWSLETTER_RETRY_MAX_DELAY = float(os.getenv('NEWSLETTER_RETRY_MAX_DELAY', 3600))
+
+# How many pre-rendered newsletter messages are kept in memory
+NEWSLETTER_RENDER_CACHE_SIZE = int(os.getenv('NEWSLETTER_RENDER_CACHE_SIZE', 64))
+
+# Runs with more recipients than NEWSLETTER_SHARD_SIZE are split into shards
+# that any number of `manage.py run_shard_worker` processes can claim
+# (0 disables sharding); a running shard that reports no progress for
+# NEWSLETTER_SHARD_TIMEOUT seconds is handed to another worker
+NEWSLETTER_SHARD_SIZE = int(os.getenv('NEWSLETTER_SHARD_SIZE', 50000))
+NEWSLETTER_SHARD_TIMEOUT = float(os.getenv('NEWSLETTER_SHARD_TIMEOUT', 600))
+
+# Every NEWSLETTER_SWEEP_INTERVAL seconds the scheduler claims due dispatch
+# tasks for its NEWSLETTER_DISPATCH_THREADS threads; sends missed by more
+# than NEWSLETTER_MISFIRE_GRACE seconds are skipped. Tasks running for
+# longer than NEWSLETTER_TASK_TIMEOUT seconds are taken over, at most
+# NEWSLETTER_TASK_MAX_ATTEMPTS times
+NEWSLETTER_SWEEP_INTERVAL = int(os.getenv('NEWSLETTER_SWEEP_INTERVAL', 30))
+NEWSLETTER_DISPATCH_THREADS = int(os.getenv('NEWSLETTER_DISPATCH_THREADS', 8))
+NEWSLETTER_MISFIRE_GRACE = int(os.getenv('NEWSLETTER_MISFIRE_GRACE', 300))
+NEWSLETTER_TASK_TIMEOUT = int(os.getenv('NEWSLETTER_TASK_TIMEOUT', 1800))
+NEWSLETTER_TASK_MAX_ATTEMPTS = int(os.getenv('NEWSLETTER_TASK_MAX_ATTEMPTS', 3))
+
+# Home page statistics are kept up to date on every change and recounted
+# every NEWSLETTER_STATS_INTERVAL seconds, as newsletters become active or
+# inactive with time alone
+NEWSLETTER_STATS_INTERVAL = int(os.getenv('NEWSLETTER_STATS_INTERVAL', 60))
+
+# Newsletters with a send window are released at an even rate in bursts of
+# at most NEWSLETTER_PACING_BURST recipients
+NEWSLETTER_PACING_BURST = int(os.getenv('NEWSLETTER_PACING_BURST', 50))
+
+# Outbound mail budgets, 0 means unlimited. The domain budgets apply to
+# every recipient domain unless NEWSLETTER_DOMAIN_RATES, a JSON object like
+# {"gmail.com": [20, 20000]}, gives a domain its own per second and per
+# hour limits. Counters live in the NEWSLETTER_RATE_CACHE cache, so it has
+# to be shared (Redis) for the budgets to hold across processes
+NEWSLETTER_RATE_PER_SECOND = int(os.getenv('NEWSLETTER_RATE_PER_SECOND', 0))
+NEWSLETTER_RATE_PER_HOUR = int(os.getenv('NEWSLETTER_RATE_PER_HOUR', 0))
+NEWSLETTER_DOMAIN_RATE_PER_SECOND = int(os.getenv('NEWSLETTER_DOMAIN_RATE_PER_SECOND', 0))
+NEWSLETTER_DOMAIN_RATE_PER_HOUR = int(os.getenv('NEWSLETTER_DOMAIN_RATE_PER_HOUR', 0))
+NEWSLETTER_DOMAIN_RATES = json.loads(os.getenv('NEWSLETTER_DOMAIN_RATES', '{}'))
+NEWSLETTER_RATE_CACHE = os.getenv('NEWSLETTER_RATE_CACHE', 'default')
+
+# Finishing a newsletter raises a flag in NEWSLETTER_CANCEL_CACHE for
+# NEWSLETTER_CANCEL_TTL seconds; runs in flight check it between batches
+NEWSLETTER_CANCEL_CACHE = os.getenv('NEWSLETTER_CANCEL_CACHE', 'default')
+NEWSLETTER_CANCEL_TTL = int(os.getenv('NEWSLETTER_CANCEL_TTL', 86400))
+
+# Owners share NEWSLETTER_FAIR_SLOTS concurrent batches per process in
+# proportion to their send_weight, and at most NEWSLETTER_OWNER_TASKS of an
+# owner's dispatch tasks run at once (0 for no limit)
+NEWSLETTER_FAIR_SLOTS = int(os.getenv('NEWSLETTER_FAIR_SLOTS', 4))
+NEWSLETTER_OWNER_TASKS = int(os.getenv('NEWSLETTER_OWNER_TASKS', 2))
+
+# Transactional mail goes through a high priority lane of its own in every
+# process: NEWSLETTER_PRIORITY_WORKERS threads with their own connections,
+# closed after NEWSLETTER_PRIORITY_IDLE seconds without mail
+NEWSLETTER_PRIORITY_WORKERS = int(os.getenv('NEWSLETTER_PRIORITY_WORKERS', 2))
+NEWSLETTER_PRIORITY_QUEUE = int(os.getenv('NEWSLETTER_PRIORITY_QUEUE', 100))
+NEWSLETTER_PRIORITY_IDLE = int(os.getenv('NEWSLETTER_PRIORITY_IDLE', 30))
+
+# Only the run_scheduler process holding the lease schedules anything; it
+# renews the lease every third of NEWSLETTER_SCHEDULER_LEASE seconds and
+# serves scheduling metrics on NEWSLETTER_METRICS_PORT unless it is 0
+NEWSLETTER_SCHEDULER_LEASE = int(os.getenv('NEWSLETTER_SCHEDULER_LEASE', 30))
+NEWSLETTER_METRICS_PORT = int(os.getenv('NEWSLETTER_METRICS_PORT', 0))
+
 SERVER_EMAIL = EMAIL_HOST_USER
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
@@ -175,6 +265,22 @@ LOGGING = {
 CACHE_TTL = getattr(settings, 'CACHE_TTL', DEFAULT_TIMEOUT)
 CACHE_ENABLED = os.getenv('CACHE_ENABLED', True) == 'True'
 
+# The main page keeps at most CACHE_LIST_VARIANTS cached renderings of the
+# newsletter list per version, one per owner and permission set
+CACHE_LIST_VARIANTS = int(os.getenv('CACHE_LIST_VARIANTS', 100))
+
+# Page data is read through the CACHE_SERVICES alias: an in-process LRU of
+# CACHE_L1_ENTRIES values kept for up to CACHE_L1_TIMEOUT seconds in front
+# of Redis. Writes from any process reach the others within
+# CACHE_STAMP_INTERVAL seconds
+CACHE_SERVICES = os.getenv('CACHE_SERVICES', 'tiered')
+CACHE_L1_ENTRIES = int(os.getenv('CACHE_L1_ENTRIES', 1000))
+CACHE_L1_TIMEOUT = float(os.getenv('CACHE_L1_TIMEOUT', 5))
+CACHE_STAMP_INTERVAL = float(os.getenv('CACHE_STAMP_INTERVAL', 1))
+# Prefixes of versioned keys that never change once written; writing them
+# leaves the L1 of other processes alone
+CACHE_WRITE_ONCE_KEYS = ['newsletters_list:', 'main_page:']
+
 if CACHE_ENABLED:
     CACHES = {
         'default': {
@@ -184,5 +290,16 @@ if CACHE_ENABLED:
                 'CLIENT_CLASS': 'django_redis.client.DefaultClient',
             },
             'KEY_PREFIX': 'example'
-        }
+        },
+        'tiered': {
+            'BACKEND': 'newsletter.cache_backends.TwoLevelCache',
+            'LOCATION': 'default',
+            'TIMEOUT': CACHE_TTL,
+            'OPTIONS': {
+                'MAX_ENTRIES': CACHE_L1_ENTRIES,
+                'L1_TIMEOUT': CACHE_L1_TIMEOUT,
+                'STAMP_INTERVAL': CACHE_STAMP_INTERVAL,
+                'WRITE_ONCE_KEYS': CACHE_WRITE_ONCE_KEYS,
+            },
+        },
     }
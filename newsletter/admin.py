@@ -21,5 +21,6 @@ class AdminNewsletter(admin.ModelAdmin):
     list_display = ('initial', 'frequency', )
     search_fields = ('message', 'client', 'initial', )
     list_filter = ('initial', )
+    readonly_fields = Newsletter.SCHEDULER_FIELDS
 
 
@@ -6,5 +6,5 @@ class NewsletterConfig(AppConfig):
     name = 'newsletter'
 
     def ready(self):
-        from .scheduler import start_scheduler
-        start_scheduler()
\ No newline at end of file
+        import newsletter.checks  # noqa: F401
+        import newsletter.signals  # noqa: F401
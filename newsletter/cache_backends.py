@@ -0,0 +1,272 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from newsletter.metrics import registry
+
+MISSING = object()
+
+# One L1 per process and location; Django creates backends per thread
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class L1Store:
+    """
+    Bounded LRU of pickled values with per-entry expiry, together with the
+    last stamp read from L2 and lookup counts of both levels.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.stamp = None
+        self.checked_at = 0
+        self.counts = {('l1', 'hit'): 0, ('l1', 'miss'): 0, ('l2', 'hit'): 0, ('l2', 'miss'): 0}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            pickled, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (pickled, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def count(self, level, result):
+        with self.lock:
+            self.counts[level, result] += 1
+
+
+class TwoLevelCache(BaseCache):
+    """
+    A bounded in-process LRU (L1) in front of another configured cache (L2),
+    named by LOCATION.
+
+    L1 keeps values for at most L1_TIMEOUT seconds. Writes through this
+    backend bump a stamp kept in L2, and a process reads the stamp at most
+    every STAMP_INTERVAL seconds, dropping its whole L1 when it has moved;
+    so a value changed by any process is seen everywhere within
+    STAMP_INTERVAL seconds, and reads cost no round trip in between.
+    Counters (incr/decr) always go to L2 and are never kept in L1.
+
+    Keys starting with one of WRITE_ONCE_KEYS never bump the stamp: they
+    are versioned keys whose value does not change once written (or
+    counters only read through incr), so no copy of them can go stale.
+
+        'tiered': {
+            'BACKEND': 'newsletter.cache_backends.TwoLevelCache',
+            'LOCATION': 'default',
+            'OPTIONS': {'MAX_ENTRIES': 1000, 'L1_TIMEOUT': 5, 'STAMP_INTERVAL': 1,
+                        'WRITE_ONCE_KEYS': ['newsletters_list:']},
+        }
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.location = location
+        self.l1_timeout = float(options.get('L1_TIMEOUT', 5))
+        self.stamp_interval = float(options.get('STAMP_INTERVAL', 1))
+        self.stamp_key = options.get('STAMP_KEY', f'l1-stamp:{location}')
+        self.write_once_keys = tuple(options.get('WRITE_ONCE_KEYS', ()))
+        with _stores_lock:
+            self.store = _stores.setdefault((location, self.key_prefix), L1Store(self._max_entries))
+
+    @property
+    def l2(self):
+        return caches[self.location]
+
+    def _count(self, level, result):
+        self.store.count(level, result)
+        registry.inc('newsletter_cache_lookups_total', 'Two-level cache lookups by level', level=level, result=result)
+
+    def _sync(self):
+        """Drops L1 if another process has written since the stamp was last read."""
+        store = self.store
+        now = time.monotonic()
+        if now - store.checked_at < self.stamp_interval:
+            return
+        stamp = self.l2.get(self.stamp_key)
+        if stamp is None:
+            # Start above any stamp that may have been evicted
+            self.l2.add(self.stamp_key, int(time.time() * 1000), timeout=None)
+            stamp = self.l2.get(self.stamp_key)
+        with store.lock:
+            if stamp != store.stamp:
+                store.entries.clear()
+                store.stamp = stamp
+            store.checked_at = now
+
+    def _bump(self, *keys):
+        """Moves the stamp on after a write, keeping L1 if nobody else wrote in between."""
+        if self.write_once_keys and keys and all(key.startswith(self.write_once_keys) for key in keys):
+            return
+        store = self.store
+        try:
+            stamp = self.l2.incr(self.stamp_key)
+        except ValueError:
+            self.l2.add(self.stamp_key, int(time.time() * 1000), timeout=None)
+            stamp = self.l2.get(self.stamp_key)
+        with store.lock:
+            if store.stamp is None or stamp != store.stamp + 1:
+                store.entries.clear()
+            store.stamp = stamp
+            store.checked_at = time.monotonic()
+
+    def _l1_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def _remember(self, key, value, timeout=DEFAULT_TIMEOUT):
+        timeout = self._l1_timeout(timeout)
+        if timeout > 0:
+            self.store.set(key, value, timeout)
+
+    def get(self, key, default=None, version=None):
+        l1_key = self.make_and_validate_key(key, version=version)
+        self._sync()
+        value = self.store.get(l1_key)
+        if value is not MISSING:
+            self._count('l1', 'hit')
+            return value
+        self._count('l1', 'miss')
+        value = self.l2.get(key, MISSING, version=version)
+        if value is MISSING:
+            self._count('l2', 'miss')
+            return default
+        self._count('l2', 'hit')
+        self._remember(l1_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        found = {}
+        missed = []
+        for key in keys:
+            value = self.store.get(self.make_and_validate_key(key, version=version))
+            if value is MISSING:
+                missed.append(key)
+            else:
+                found[key] = value
+        for _ in found:
+            self._count('l1', 'hit')
+        for _ in missed:
+            self._count('l1', 'miss')
+        if missed:
+            fetched = self.l2.get_many(missed, version=version)
+            for key in missed:
+                if key in fetched:
+                    self._count('l2', 'hit')
+                    self._remember(self.make_key(key, version=version), fetched[key])
+                else:
+                    self._count('l2', 'miss')
+            found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None):
+        self._sync()
+        if self.store.get(self.make_and_validate_key(key, version=version)) is not MISSING:
+            return True
+        return self.l2.has_key(key, version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        l1_key = self.make_and_validate_key(key, version=version)
+        self.l2.set(key, value, timeout=timeout, version=version)
+        self._bump(key)
+        self._remember(l1_key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout=timeout, version=version)
+        self._bump(*data)
+        for key, value in data.items():
+            if key not in failed:
+                self._remember(self.make_and_validate_key(key, version=version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        l1_key = self.make_and_validate_key(key, version=version)
+        if not self.l2.add(key, value, timeout=timeout, version=version):
+            return False
+        self._bump(key)
+        self._remember(l1_key, value, timeout)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        l1_key = self.make_and_validate_key(key, version=version)
+        deleted = self.l2.delete(key, version=version)
+        self.store.delete(l1_key)
+        self._bump()
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        self.l2.delete_many(keys, version=version)
+        for key in keys:
+            self.store.delete(self.make_and_validate_key(key, version=version))
+        self._bump()
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version=version)
+        self.store.delete(self.make_and_validate_key(key, version=version))
+        self._bump(key)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def clear(self):
+        self.l2.clear()
+        self.store.clear()
+        self._bump()
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
+
+    def stats(self):
+        """Lookups and hit rate of each level in this process."""
+        with self.store.lock:
+            counts = dict(self.store.counts)
+        stats = {}
+        for level in ('l1', 'l2'):
+            hits, misses = counts[level, 'hit'], counts[level, 'miss']
+            stats[level] = {'hits': hits, 'misses': misses,
+                            'hit_rate': hits / (hits + misses) if hits + misses else 0}
+        return stats
+
+
+def is_shared(alias):
+    """Whether every process sees the same cache under ``alias``, rather than one of its own."""
+    backend = caches[alias]
+    if isinstance(backend, TwoLevelCache):
+        return is_shared(backend.location)
+    return not isinstance(backend, (LocMemCache, DummyCache))
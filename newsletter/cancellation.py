@@ -0,0 +1,31 @@
+from django.apps import apps
+from django.core.cache import caches
+
+from config.settings import NEWSLETTER_CANCEL_CACHE, NEWSLETTER_CANCEL_TTL
+from newsletter.cache_backends import is_shared
+
+
+class RunCancelled(Exception):
+    pass
+
+
+def cancel_key(newsletter_id):
+    return f'newsletter-cancel:{newsletter_id}'
+
+
+def request_cancel(newsletter_id):
+    """Asks runs of the newsletter that are in flight, on any node, to stop after their current batch."""
+    caches[NEWSLETTER_CANCEL_CACHE].set(cancel_key(newsletter_id), True, timeout=NEWSLETTER_CANCEL_TTL)
+
+
+def clear_cancel(newsletter_id):
+    caches[NEWSLETTER_CANCEL_CACHE].delete(cancel_key(newsletter_id))
+
+
+def is_cancelled(newsletter_id):
+    if is_shared(NEWSLETTER_CANCEL_CACHE):
+        return caches[NEWSLETTER_CANCEL_CACHE].get(cancel_key(newsletter_id), False)
+    # A flag in a per-process cache never reaches the scheduler or the
+    # shard workers, so ask the database instead
+    Newsletter = apps.get_model('newsletter', 'Newsletter')
+    return Newsletter.objects.filter(pk=newsletter_id, finished=True).exists()
@@ -0,0 +1,17 @@
+from django.core.checks import Error, register
+
+from config.settings import NEWSLETTER_RATE_CACHE
+from newsletter.cache_backends import is_shared
+from newsletter.ratelimit import rate_limiter
+
+
+@register()
+def check_rate_cache(app_configs, **kwargs):
+    if rate_limiter.enabled and not is_shared(NEWSLETTER_RATE_CACHE):
+        return [Error(
+            f"Rate limits are counted in the '{NEWSLETTER_RATE_CACHE}' cache, which is not shared between "
+            f"processes, so every process would send at the full rate.",
+            hint="Set CACHE_ENABLED=True or point NEWSLETTER_RATE_CACHE at a shared cache.",
+            id='newsletter.E001',
+        )]
+    return []
@@ -0,0 +1,382 @@
+import logging
+import random
+import smtplib
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from config.settings import NEWSLETTER_ATTEMPT_BATCH_SIZE, NEWSLETTER_ATTEMPT_FLUSH_INTERVAL, \
+    NEWSLETTER_RECIPIENT_CHUNK_SIZE, NEWSLETTER_RETRY_BASE_DELAY, NEWSLETTER_RETRY_MAX_DELAY
+from newsletter.cancellation import RunCancelled, is_cancelled
+from newsletter.dispatch import RETRY, enqueue
+from newsletter.fairshare import fair_share
+from newsletter.mailer import recipient_domain
+from newsletter.metrics import registry
+from newsletter.pacing import Pacer
+from newsletter.ratelimit import QuotaExceeded, send_quota, rate_limiter
+from newsletter.rendering import render_message
+from newsletter.workers import get_sender
+
+logger = logging.getLogger(__name__)
+
+
+class DuplicateRun(Exception):
+    pass
+
+
+SMTP_OK = 250
+NO_REPLY = 0
+
+
+def smtp_code(error):
+    """SMTP reply code carried by a send error, or NO_REPLY if the server never answered."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        return next(iter(error.recipients.values()))[0]
+    return NO_REPLY
+
+
+def is_transient(code):
+    return code == NO_REPLY or 400 <= code < 500
+
+
+def retry_delay(retries):
+    """Exponential backoff with jitter: half of the delay is fixed, the other half random."""
+    delay = min(NEWSLETTER_RETRY_MAX_DELAY, NEWSLETTER_RETRY_BASE_DELAY * 2 ** retries)
+    return timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_recipients(newsletter, after_id=None, last_id=None, chunk_size=NEWSLETTER_RECIPIENT_CHUNK_SIZE):
+    """
+    Streams the newsletter's clients as light ``(id, email, full_name)``
+    rows, fetched in chunks through a server-side cursor.
+    """
+    clients = newsletter.clients.order_by('id')
+    if after_id is not None:
+        clients = clients.filter(id__gt=after_id)
+    if last_id is not None:
+        clients = clients.filter(id__lte=last_id)
+    return clients.values_list('id', 'email', 'full_name', named=True).iterator(chunk_size=chunk_size)
+
+
+def last_claimed_client(newsletter, first_id=None, last_id=None):
+    """
+    Checkpoint of the newsletter's current run: recipients are claimed in id
+    order, so everyone up to the returned client id has an Attempt already.
+    ``first_id`` and ``last_id`` narrow it down to one shard of the run.
+    """
+    Attempt = apps.get_model('newsletter', 'Attempt')
+    attempts = Attempt.objects.filter(newsletter=newsletter, run=newsletter.run)
+    if first_id is not None:
+        attempts = attempts.filter(client_id__gte=first_id)
+    if last_id is not None:
+        attempts = attempts.filter(client_id__lte=last_id)
+    return attempts.aggregate(last=Max('client_id'))['last']
+
+
+def set_run_status(newsletter, status):
+    """
+    Records the outcome of the newsletter's run. Nothing else is written,
+    so edits made while the run was sending survive, and nothing at all if
+    a later run has started since.
+    """
+    Newsletter = apps.get_model('newsletter', 'Newsletter')
+    newsletter.status = status
+    Newsletter.objects.filter(id=newsletter.id, run=newsletter.run).update(status=status)
+
+
+class AttemptBuffer:
+    """
+    Claims recipients of a run before anything is sent to them and writes the
+    outcomes back in bulk.
+
+    ``claim()`` inserts one Attempt per recipient in status 'P' with a single
+    bulk_create; the (newsletter, run, client) unique constraint turns a
+    second claim of the same client into DuplicateRun, so nobody receives the
+    same run twice. Outcomes are written with one bulk_update when
+    ``batch_size`` of them are pending or ``flush_interval`` seconds have
+    passed since the last flush. If the run stops early, claims that were
+    never handed to the sender are released so a later run picks them up.
+
+    Transient failures get ``next_retry_at`` set with exponential backoff
+    until the newsletter's ``max_attempts`` is used up; ``next_retry_at``
+    on the buffer is the earliest retry it has scheduled.
+    """
+
+    def __init__(self, newsletter, batch_size=NEWSLETTER_ATTEMPT_BATCH_SIZE,
+                 flush_interval=NEWSLETTER_ATTEMPT_FLUSH_INTERVAL):
+        self.newsletter = newsletter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.unsent = set()
+        self.written = 0
+        self.next_retry_at = None
+        self._flushed_at = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.release()
+        self.flush()
+
+    def claim(self, recipients):
+        Attempt = apps.get_model('newsletter', 'Attempt')
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                claimed = Attempt.objects.bulk_create([
+                    Attempt(
+                        newsletter=self.newsletter,
+                        client_id=recipient.id,
+                        message_id=self.newsletter.message_id,
+                        run=self.newsletter.run,
+                        last_attempt_time=now,
+                        last_attempt_status='P',
+                        server_response=0
+                    )
+                    for recipient in recipients
+                ])
+        except IntegrityError:
+            raise DuplicateRun(
+                f"Run {self.newsletter.run} of newsletter {self.newsletter.id} is already being sent"
+            )
+        self.unsent.update(attempt.pk for attempt in claimed)
+        return claimed
+
+    def mark_sending(self, attempt):
+        self.unsent.discard(attempt.pk)
+
+    def release(self):
+        if not self.unsent:
+            return
+        Attempt = apps.get_model('newsletter', 'Attempt')
+        Attempt.objects.filter(pk__in=self.unsent).delete()
+        logger.info(f"Released {len(self.unsent)} unsent claims of newsletter {self.newsletter.id}")
+        self.unsent = set()
+
+    def record(self, item, error):
+        attempt, client = item
+        if error is None:
+            self.resolve(attempt, 'S', SMTP_OK)
+            logger.info(f"Attempt successful for {client.email}")
+            return
+
+        code = smtp_code(error)
+        next_retry_at = None
+        if is_transient(code) and attempt.retries + 1 < self.newsletter.max_attempts:
+            next_retry_at = timezone.now() + retry_delay(attempt.retries)
+            if self.next_retry_at is None or next_retry_at < self.next_retry_at:
+                self.next_retry_at = next_retry_at
+        self.resolve(attempt, 'F', code, next_retry_at)
+        logger.error(f"Attempt failed for {client.email} ({code}): {error}")
+
+    def resolve(self, attempt, status, server_response, next_retry_at=None):
+        attempt.last_attempt_time = timezone.now()
+        attempt.last_attempt_status = status
+        attempt.server_response = server_response
+        attempt.next_retry_at = next_retry_at
+        self.pending.append(attempt)
+        if (len(self.pending) >= self.batch_size
+                or time.monotonic() - self._flushed_at >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        if not self.pending:
+            return
+        Attempt = apps.get_model('newsletter', 'Attempt')
+        Attempt.objects.bulk_update(
+            self.pending,
+            ['last_attempt_time', 'last_attempt_status', 'server_response', 'retries', 'next_retry_at'],
+            batch_size=self.batch_size
+        )
+        self.written += len(self.pending)
+        logger.debug(f"Flushed {len(self.pending)} attempts")
+        self.pending = []
+
+
+def retry_failed_attempts(newsletter):
+    """
+    Resends the newsletter's failed attempts whose retry is due, over one
+    sender. Attempts that fail again get a later ``next_retry_at`` and a
+    retry task on the dispatch queue.
+    """
+    Attempt = apps.get_model('newsletter', 'Attempt')
+    rendered = render_message(newsletter.message)
+    due = (
+        Attempt.objects
+        .filter(newsletter=newsletter, last_attempt_status='F', next_retry_at__lte=timezone.now())
+        .select_related('client')
+        .order_by('next_retry_at')
+    )
+
+    logger.info(f"Retrying failed attempts of newsletter {newsletter.id}")
+    sender = get_sender()
+    with AttemptBuffer(newsletter) as attempts:
+        with sender:
+            for attempt in due.iterator(chunk_size=NEWSLETTER_RECIPIENT_CHUNK_SIZE):
+                attempt.retries += 1
+                sender.submit((attempt, attempt.client), rendered.for_recipient(attempt.client))
+                for result in sender.completed():
+                    attempts.record(*result)
+        for result in sender.completed():
+            attempts.record(*result)
+
+    logger.info(f"Newsletter {newsletter.id}: retried {attempts.written} attempts, {sender.sent} delivered")
+    if attempts.next_retry_at is not None:
+        enqueue(newsletter.id, RETRY, attempts.next_retry_at, earliest=True)
+    return attempts.written
+
+
+def run_pacer(newsletter, after_id=None, last_id=None):
+    """
+    Pacer for the recipients after ``after_id`` (up to ``last_id``). The
+    recipients the whole run has left are spread evenly until the end of
+    the send window, counted from the start of the run, and that rate is
+    shared between the shards of the run that are sending; so resumed runs
+    and shards sent one after another still finish within the window. Runs
+    past the end of their window are not paced.
+    """
+    Attempt = apps.get_model('newsletter', 'Attempt')
+    Shard = apps.get_model('newsletter', 'Shard')
+    now = timezone.now()
+    deadline = (newsletter.run_started_at or now) + timedelta(minutes=newsletter.send_window)
+    time_left = (deadline - now).total_seconds()
+    if time_left <= 0:
+        logger.warning(f"Newsletter {newsletter.id} is past the end of its send window, sending unpaced")
+        return None
+
+    remaining = newsletter.clients.filter(id__gt=after_id or 0)
+    if last_id is not None:
+        remaining = remaining.filter(id__lte=last_id)
+    remaining = remaining.count()
+    run_remaining = newsletter.clients.count() - Attempt.objects.filter(newsletter=newsletter, run=newsletter.run).count()
+    sending = Shard.objects.filter(newsletter=newsletter, run=newsletter.run, state='R').count()
+    rate = max(run_remaining, remaining, 1) / time_left / max(sending, 1)
+    return Pacer(remaining, max(remaining, 1) / rate)
+
+
+def deliver_newsletter(newsletter, first_id=None, last_id=None, progress=None):
+    """
+    Sends the current run of the newsletter, or only its clients with ids
+    between ``first_id`` and ``last_id`` when delivering a shard.
+    ``progress`` is called with the size of every batch that was sent.
+    Newsletters with a ``send_window`` are paced by ``run_pacer()`` to
+    finish by the end of the window. Returns how many recipients got an
+    outcome recorded.
+
+    The cancellation flag is checked before every batch; once it is up the
+    run finishes the batch in flight, writes its outcomes and raises
+    RunCancelled. Every batch is taken from the owner's send quotas and
+    waits for its owner's turn in ``fair_share``, which it holds until the
+    batch has been sent; when a quota runs out the run stops and raises
+    QuotaExceeded with the time it can resume. Rate limits are waited out
+    with the turn given up, so a throttled domain does not keep other
+    owners from sending.
+    """
+    Attempt = apps.get_model('newsletter', 'Attempt')
+    rendered = render_message(newsletter.message)
+
+    logger.info(f"Sending newsletter {newsletter.id} to clients")
+    after_id = last_claimed_client(newsletter, first_id, last_id)
+    if after_id is not None:
+        in_doubt = Attempt.objects.filter(
+            newsletter=newsletter, run=newsletter.run, client_id__lte=after_id, last_attempt_status='P'
+        )
+        if first_id is not None:
+            in_doubt = in_doubt.filter(client_id__gte=first_id)
+        logger.warning(f"Resuming run {newsletter.run} of newsletter {newsletter.id} after client {after_id}, "
+                       f"{in_doubt.count()} interrupted attempts will not be repeated")
+    elif first_id is not None:
+        after_id = first_id - 1
+
+    pacer = None
+    if newsletter.send_window:
+        pacer = run_pacer(newsletter, after_id, last_id)
+
+    owner = newsletter.user
+    owner_id, weight = (owner.id, owner.send_weight) if owner is not None else (0, 1)
+    has_quota = owner is not None and (owner.send_quota_hour or owner.send_quota_day)
+    resume_at = None
+
+    cancelled = False
+    # Rate limits are taken here, where the turn can be given up while waiting
+    limiter = rate_limiter if rate_limiter.enabled else None
+    sender = get_sender(limiter=None)
+    with AttemptBuffer(newsletter) as attempts:
+        # Paced runs claim what they send in about one flush interval, so
+        # claims and progress reports keep up with the pace, and no more than
+        # one burst, as a batch goes out back to back once it is released
+        batch_size = attempts.batch_size
+        if pacer is not None:
+            batch_size = max(1, min(batch_size, int(pacer.target_rate * attempts.flush_interval),
+                                    pacer.bucket.capacity))
+        with sender:
+            for batch in batched(iter_recipients(newsletter, after_id, last_id), batch_size):
+                if is_cancelled(newsletter.id):
+                    cancelled = True
+                    break
+                if has_quota:
+                    granted, resume_at = send_quota.take(
+                        owner_id, len(batch), owner.send_quota_hour, owner.send_quota_day
+                    )
+                    batch = batch[:granted]
+                if batch:
+                    # Paced runs wait for their tokens before their turn, so
+                    # they do not hold a fair share slot while they sleep
+                    if pacer is not None:
+                        pacer.release(len(batch))
+                    with fair_share.turn(owner_id, weight, len(batch)) as turn:
+                        for attempt, client in zip(attempts.claim(batch), batch):
+                            message = rendered.for_recipient(client)
+                            if limiter is not None:
+                                while wait := limiter.reserve(recipient_domain(message)):
+                                    with turn.paused():
+                                        time.sleep(wait)
+                            logger.info(f"Sending email to {client.email}")
+                            attempts.mark_sending(attempt)
+                            sender.submit((attempt, client), message)
+                            for result in sender.completed():
+                                attempts.record(*result)
+                        # The turn covers the sending, not only the handing over to the workers
+                        for result in sender.drain():
+                            attempts.record(*result)
+                    if progress is not None:
+                        progress(len(batch))
+                if resume_at is not None:
+                    break
+        for result in sender.completed():
+            attempts.record(*result)
+
+    if cancelled:
+        registry.inc('newsletter_runs_cancelled_total', 'Runs stopped because their newsletter was finished')
+        raise RunCancelled(f"Run {newsletter.run} of newsletter {newsletter.id} was cancelled "
+                           f"after {attempts.written} recipients")
+
+    if attempts.next_retry_at is not None:
+        enqueue(newsletter.id, RETRY, attempts.next_retry_at, earliest=True)
+
+    logger.info(f"Newsletter {newsletter.id}: sent {sender.sent} messages in {sender.elapsed:.2f}s "
+                f"({sender.rate:.1f} msg/s)")
+    if pacer is not None:
+        pacer.report(newsletter.id)
+    if resume_at is not None:
+        registry.inc('newsletter_quota_stops_total', 'Runs stopped by their owner\'s send quota')
+        raise QuotaExceeded(f"Newsletter {newsletter.id} used up the send quota of user {owner_id}",
+                            datetime.fromtimestamp(resume_at, tz=dt_timezone.utc))
+    return attempts.written
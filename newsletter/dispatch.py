@@ -0,0 +1,128 @@
+import logging
+from datetime import timedelta
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from config.settings import NEWSLETTER_TASK_TIMEOUT, NEWSLETTER_TASK_MAX_ATTEMPTS, NEWSLETTER_OWNER_TASKS
+
+logger = logging.getLogger(__name__)
+
+SEND = 'S'
+RETRY = 'R'
+RESUME = 'C'
+
+# Due tasks looked at per claimed one, so busy owners can be skipped
+CLAIM_LOOKAHEAD = 4
+
+
+def enqueue(newsletter_id, kind, due_at, earliest=False):
+    """
+    Puts a waiting task of ``kind`` for the newsletter on the queue, due at
+    ``due_at``. A newsletter has at most one waiting task of each kind: an
+    existing one is moved to ``due_at``, or only moved earlier when
+    ``earliest`` is set.
+    """
+    DispatchTask = apps.get_model('newsletter', 'DispatchTask')
+    waiting = DispatchTask.objects.filter(newsletter_id=newsletter_id, kind=kind, state='W')
+    if earliest:
+        waiting = waiting.filter(due_at__gt=due_at)
+    if waiting.update(due_at=due_at):
+        return
+    try:
+        with transaction.atomic():
+            DispatchTask.objects.create(newsletter_id=newsletter_id, kind=kind, due_at=due_at)
+    except IntegrityError:
+        if not earliest:
+            DispatchTask.objects.filter(newsletter_id=newsletter_id, kind=kind, state='W').update(due_at=due_at)
+
+
+def dequeue(newsletter_id, kind):
+    DispatchTask = apps.get_model('newsletter', 'DispatchTask')
+    DispatchTask.objects.filter(newsletter_id=newsletter_id, kind=kind, state='W').delete()
+
+
+def pick_fair(candidates, running, limit, per_owner=NEWSLETTER_OWNER_TASKS):
+    """
+    Picks up to ``limit`` of the candidate tasks, one owner at a time in
+    round-robin, owners with the oldest due task first. Owners that already
+    have ``per_owner`` tasks ``running`` get no more.
+    """
+    by_owner = {}
+    for task in candidates:
+        by_owner.setdefault(task.owner_id, []).append(task)
+    picked = []
+    while len(picked) < limit and by_owner:
+        for owner_id in list(by_owner):
+            tasks = by_owner[owner_id]
+            if per_owner and running.get(owner_id, 0) >= per_owner:
+                del by_owner[owner_id]
+                continue
+            picked.append(tasks.pop(0))
+            running[owner_id] = running.get(owner_id, 0) + 1
+            if not tasks:
+                del by_owner[owner_id]
+            if len(picked) == limit:
+                break
+    return picked
+
+
+def claim_tasks(worker, limit):
+    """
+    Takes up to ``limit`` due tasks with SELECT ... FOR UPDATE SKIP LOCKED
+    so concurrent workers never get the same task, shared out between
+    owners by ``pick_fair()``. Running tasks whose worker has not called
+    ``touch_task()`` for NEWSLETTER_TASK_TIMEOUT are taken over, until
+    NEWSLETTER_TASK_MAX_ATTEMPTS is used up.
+    """
+    DispatchTask = apps.get_model('newsletter', 'DispatchTask')
+    now = timezone.now()
+    stale = now - timedelta(seconds=NEWSLETTER_TASK_TIMEOUT)
+    given_up = DispatchTask.objects.filter(
+        state='R', heartbeat_at__lt=stale, attempts__gte=NEWSLETTER_TASK_MAX_ATTEMPTS
+    ).update(state='F', finished_at=now)
+    if given_up:
+        logger.error(f"Gave up {given_up} dispatch tasks after {NEWSLETTER_TASK_MAX_ATTEMPTS} attempts")
+    if limit <= 0:
+        return []
+
+    running = dict(
+        DispatchTask.objects
+        .filter(state='R', heartbeat_at__gte=stale)
+        .values_list('newsletter__user_id')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    due = (
+        DispatchTask.objects
+        .filter(Q(state='W', due_at__lte=now) | Q(state='R', heartbeat_at__lt=stale))
+        .annotate(owner_id=F('newsletter__user_id'))
+        .select_for_update(skip_locked=True, of=('self',))
+        .order_by('due_at')
+    )
+    with transaction.atomic():
+        tasks = pick_fair(due[:limit * CLAIM_LOOKAHEAD], running, limit)
+        if tasks:
+            DispatchTask.objects.filter(pk__in=[task.pk for task in tasks]).update(
+                state='R', locked_by=worker, locked_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+            )
+    for task in tasks:
+        task.state, task.locked_by, task.locked_at, task.heartbeat_at = 'R', worker, now, now
+        task.attempts += 1
+    return tasks
+
+
+def touch_task(task):
+    DispatchTask = apps.get_model('newsletter', 'DispatchTask')
+    DispatchTask.objects.filter(pk=task.pk, locked_by=task.locked_by).update(heartbeat_at=timezone.now())
+
+
+def finish_task(task, state='D'):
+    DispatchTask = apps.get_model('newsletter', 'DispatchTask')
+    task.state = state
+    task.finished_at = timezone.now()
+    DispatchTask.objects.filter(pk=task.pk, locked_by=task.locked_by).update(
+        state=task.state, started_at=task.started_at, finished_at=task.finished_at, recipients=task.recipients
+    )
@@ -0,0 +1,81 @@
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+
+from config.settings import NEWSLETTER_FAIR_SLOTS
+
+
+class FairShare:
+    """
+    Weighted fair sharing of batch slots between newsletter owners.
+
+    Runs ask for a turn before every batch and at most ``slots`` batches
+    are sent at once. Turns are tagged on arrival with the owner's virtual
+    time, which advances by ``cost / weight`` with every turn it asks for
+    (start-time fair queueing), and the smallest tag goes first. Owners with
+    concurrently due newsletters are therefore served in weighted
+    round-robin, and an owner that becomes active starts at the current
+    virtual time, so it waits for the batches in flight rather than for
+    everything queued ahead of it. A batch that has to wait in the middle
+    (for a rate limit) gives its slot up meanwhile with ``Turn.paused()``.
+    """
+
+    def __init__(self, slots=NEWSLETTER_FAIR_SLOTS):
+        self.slots = slots
+        self.busy = 0
+        self.clock = 0
+        self.tags = {}
+        self._waiting = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+
+    def _acquire(self, ticket):
+        heapq.heappush(self._waiting, ticket)
+        while self.busy >= self.slots or self._waiting[0] != ticket:
+            self._cond.wait()
+        heapq.heappop(self._waiting)
+        self.busy += 1
+        self._cond.notify_all()
+
+    def _release(self):
+        with self._cond:
+            self.busy -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def turn(self, owner, weight=1, cost=1):
+        """Holds one slot for the owner's batch; yields a Turn that can give it up while waiting."""
+        with self._cond:
+            start = max(self.tags.get(owner, 0), self.clock)
+            self.tags[owner] = start + cost / max(weight, 1)
+            self._acquire((start, next(self._order)))
+            self.clock = start
+        try:
+            yield Turn(self, start)
+        finally:
+            self._release()
+
+
+class Turn:
+
+    def __init__(self, share, start):
+        self.share = share
+        self.start = start
+
+    @contextmanager
+    def paused(self):
+        """
+        Gives the slot to other owners for the duration of the block; it is
+        taken back ahead of turns that arrived later.
+        """
+        share = self.share
+        share._release()
+        try:
+            yield
+        finally:
+            with share._cond:
+                share._acquire((self.start, next(share._order)))
+
+
+fair_share = FairShare()
@@ -21,7 +21,7 @@ class NewsletterForm(FormStyleMixin, forms.ModelForm):
 
     class Meta:
         model = Newsletter
-        exclude = ('status', 'user', )
+        exclude = ('status', 'user', 'run', 'last_run_at', 'run_started_at', )
 
         widgets = {
             'initial': forms.DateTimeInput(attrs={
@@ -59,6 +59,10 @@ class MessageForm(FormStyleMixin, forms.ModelForm):
     class Meta:
         model = Message
         exclude = ('user', )
+        help_texts = {
+            'topic': 'Можно подставить данные клиента: {{ full_name }}, {{ email }}',
+            'content': 'Можно подставить данные клиента: {{ full_name }}, {{ email }}',
+        }
 
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
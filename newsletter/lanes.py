@@ -0,0 +1,115 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.core.mail import EmailMessage
+
+from config.settings import NEWSLETTER_PRIORITY_WORKERS, NEWSLETTER_PRIORITY_QUEUE, NEWSLETTER_PRIORITY_IDLE
+from newsletter.delivery import smtp_code, is_transient
+from newsletter.mailer import Mailer
+from newsletter.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SEND_ATTEMPTS = 3
+
+
+class MailLane:
+    """
+    A lane of outbound mail with capacity of its own: ``workers`` threads,
+    each with its own connection, fed from a bounded queue. Lanes do not
+    go through the bulk rate limits or fair share slots, so nothing queued
+    by newsletters can delay them. Threads start on first use and close
+    their connection after ``idle`` seconds without mail; mail still queued
+    when the process exits is sent before it does.
+    """
+
+    def __init__(self, name, workers, queue_size, idle=NEWSLETTER_PRIORITY_IDLE):
+        self.name = name
+        self.workers = workers
+        self.idle = idle
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'mail-lane-{self.name}-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            atexit.register(self.flush)
+
+    def submit(self, message):
+        """Hands the message to the lane; sends it on the calling thread if the lane is backed up."""
+        self.start()
+        try:
+            self.queue.put_nowait((time.monotonic(), message))
+        except queue.Full:
+            logger.warning(f"Mail lane {self.name} is full, sending to {message.to} inline")
+            with Mailer(limiter=None) as mailer:
+                self.send(mailer, message)
+
+    def send(self, mailer, message):
+        """
+        Sends the message, retrying transient failures; permanent ones (a
+        refused recipient) are given up on at once. Returns whether it was sent.
+        """
+        for attempt in range(SEND_ATTEMPTS):
+            try:
+                mailer.send(message)
+                registry.inc('newsletter_lane_sent_total', 'Mail sent through a lane', lane=self.name)
+                return True
+            except Exception as e:
+                code = smtp_code(e)
+                logger.error(f"Mail lane {self.name} failed to send to {message.to} ({code}): {e}")
+                mailer.close()
+                if not is_transient(code) or attempt + 1 == SEND_ATTEMPTS:
+                    break
+                time.sleep(2 ** attempt)
+        registry.inc('newsletter_lane_failed_total', 'Mail a lane gave up on', lane=self.name)
+        return False
+
+    def flush(self):
+        """Sends whatever is still queued on the calling thread."""
+        with Mailer(limiter=None) as mailer:
+            while True:
+                try:
+                    queued_at, message = self.queue.get_nowait()
+                except queue.Empty:
+                    return
+                self.send(mailer, message)
+
+    def _work(self):
+        mailer = Mailer(limiter=None)
+        while True:
+            try:
+                queued_at, message = self.queue.get(timeout=self.idle)
+            except queue.Empty:
+                mailer.close()
+                continue
+            registry.observe('newsletter_lane_wait_seconds', 'Time mail waited in its lane',
+                             time.monotonic() - queued_at, lane=self.name)
+            self.send(mailer, message)
+
+
+priority_lane = MailLane('high', NEWSLETTER_PRIORITY_WORKERS, NEWSLETTER_PRIORITY_QUEUE)
+
+
+def send_priority_mail(subject, message, recipient_list, from_email=None, wait=False):
+    """
+    Sends transactional mail (confirmations, password resets) through the
+    high priority lane without waiting for the SMTP server. With ``wait``
+    the mail is sent on the calling thread instead, for mail that must not
+    be lost; returns whether it was sent.
+    """
+    email = EmailMessage(subject, message, from_email, recipient_list)
+    if not wait:
+        priority_lane.submit(email)
+        return True
+    with Mailer(limiter=None) as mailer:
+        return priority_lane.send(mailer, email)
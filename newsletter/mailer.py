@@ -0,0 +1,89 @@
+import logging
+import smtplib
+import time
+
+from django.core.mail import get_connection
+
+from config.settings import NEWSLETTER_CONNECTION_BATCH
+from newsletter.ratelimit import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+
+def recipient_domain(message):
+    return message.to[0].rsplit('@', 1)[-1].lower()
+
+
+class Mailer:
+    """
+    Keeps one backend connection open for a whole newsletter run.
+
+    With ``batch_size`` set the connection is recycled every ``batch_size``
+    messages, otherwise it lives until ``close()``. Every message waits for
+    the ``limiter`` budgets of its recipient domain before it is sent.
+    """
+
+    def __init__(self, batch_size=NEWSLETTER_CONNECTION_BATCH, limiter=rate_limiter, **connection_kwargs):
+        self.batch_size = batch_size
+        self.limiter = limiter if limiter is not None and limiter.enabled else None
+        self.connection = get_connection(fail_silently=False, **connection_kwargs)
+        self.is_open = False
+        self.sent = 0
+        self.started_at = None
+        self._sent_since_open = 0
+
+    def __enter__(self):
+        self.started_at = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        self.connection.open()
+        self.is_open = True
+        self._sent_since_open = 0
+
+    def close(self):
+        if not self.is_open:
+            return
+        self.is_open = False
+        try:
+            self.connection.close()
+        except Exception as e:
+            logger.debug(f"Error closing mail connection: {e}")
+
+    def reconnect(self):
+        self.close()
+        self.open()
+
+    def send(self, message):
+        if self.limiter is not None:
+            self.limiter.acquire(recipient_domain(message))
+        if not self.is_open:
+            self.open()
+        elif self.batch_size and self._sent_since_open >= self.batch_size:
+            self.reconnect()
+
+        try:
+            self.connection.send_messages([message])
+        except RECONNECT_ERRORS as e:
+            logger.warning(f"Mail connection dropped ({e}), reconnecting")
+            self.reconnect()
+            self.connection.send_messages([message])
+
+        self._sent_since_open += 1
+        self.sent += 1
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return time.monotonic() - self.started_at
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed else 0.0
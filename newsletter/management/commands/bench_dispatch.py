@@ -0,0 +1,117 @@
+import json
+import resource
+import statistics
+import time
+
+from django.core.management import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from config import settings as config
+from newsletter.models import Newsletter, Message, Client
+from newsletter.scheduler import send_newsletter
+from newsletter.smtp_sink import SMTPSink, TimedEmailBackend
+from newsletter.stats import reconcile_stats
+
+BENCH_TAG = 'bench_dispatch'
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Send a synthetic newsletter through the real dispatch path to a local SMTP sink and report throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000, help='Number of synthetic clients')
+        parser.add_argument('--latency', type=float, default=0.0, help='Sink reply latency in milliseconds')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of messages the sink rejects')
+        parser.add_argument('--output', default='bench_results.jsonl', help='File the results are appended to')
+        parser.add_argument('--label', default='', help='Free-form label stored with the results')
+
+    def handle(self, *args, **options):
+        newsletter = self.seed(options['clients'])
+        TimedEmailBackend.latencies = []
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        sink = SMTPSink(latency=options['latency'] / 1000, failure_rate=options['failure_rate'])
+        try:
+            with sink, override_settings(
+                EMAIL_BACKEND='newsletter.smtp_sink.TimedEmailBackend',
+                EMAIL_HOST=sink.host,
+                EMAIL_PORT=sink.port,
+                EMAIL_USE_TLS=False,
+                EMAIL_USE_SSL=False,
+                EMAIL_HOST_USER='',
+                EMAIL_HOST_PASSWORD='',
+            ), connection.execute_wrapper(count_queries):
+                started = time.perf_counter()
+                send_newsletter(newsletter.id)
+                elapsed = time.perf_counter() - started
+        finally:
+            self.cleanup(newsletter)
+
+        latencies = TimedEmailBackend.latencies
+        messages = sink.accepted + sink.failed
+        results = {
+            'label': options['label'],
+            'timestamp': timezone.now().isoformat(),
+            'clients': options['clients'],
+            'sink_latency_ms': options['latency'],
+            'sink_failure_rate': options['failure_rate'],
+            'workers': config.NEWSLETTER_WORKERS,
+            'connection_batch': config.NEWSLETTER_CONNECTION_BATCH,
+            'attempt_batch_size': config.NEWSLETTER_ATTEMPT_BATCH_SIZE,
+            'shard_size': config.NEWSLETTER_SHARD_SIZE,
+            'accepted': sink.accepted,
+            'failed': sink.failed,
+            'seconds': round(elapsed, 3),
+            'messages_per_second': round(messages / elapsed, 1) if elapsed else 0.0,
+            'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'latency_mean_ms': round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+            'queries': queries,
+            'queries_per_message': round(queries / messages, 3) if messages else 0.0,
+            'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+        with open(options['output'], 'a') as output:
+            output.write(json.dumps(results) + '\n')
+        for key, value in results.items():
+            self.stdout.write(f'{key:>20}: {value}')
+        self.stdout.write(self.style.SUCCESS(f"Results appended to {options['output']}"))
+
+    def seed(self, total, batch=10_000):
+        message = Message.objects.create(topic=BENCH_TAG, content='Здравствуйте, {{ full_name }}!\nТекст рассылки.')
+        # bulk_create skips Newsletter.save, so no SEND task is queued for the scheduler to pick up
+        newsletter, = Newsletter.objects.bulk_create([
+            Newsletter(initial=timezone.now(), status='S', max_attempts=1, message=message)
+        ])
+        Through = Newsletter.clients.through
+        for start in range(0, total, batch):
+            clients = Client.objects.bulk_create(
+                Client(email=f'client{i}@example{i % 10}.test', full_name=f'Client {i}', comment=BENCH_TAG)
+                for i in range(start, min(start + batch, total))
+            )
+            Through.objects.bulk_create(
+                Through(newsletter_id=newsletter.pk, client_id=client.pk) for client in clients
+            )
+        return newsletter
+
+    def cleanup(self, newsletter):
+        # Attempts and M2M rows go with the newsletter; the clients are raw
+        # deleted so no signal runs per row, and the statistics are recounted once
+        Newsletter.objects.filter(pk=newsletter.pk).delete()
+        Message.objects.filter(topic=BENCH_TAG).delete()
+        Client.objects.filter(comment=BENCH_TAG)._raw_delete(Client.objects.db)
+        reconcile_stats()
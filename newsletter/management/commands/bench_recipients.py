@@ -0,0 +1,76 @@
+import time
+import tracemalloc
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from newsletter.delivery import iter_recipients
+from newsletter.models import Newsletter, Message, Client
+from newsletter.stats import reconcile_stats
+
+BENCH_TAG = 'bench_recipients'
+
+
+class Command(BaseCommand):
+    help = 'Stream the recipients of a synthetic newsletter and report memory use'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1_000_000, help='Number of synthetic clients')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Recipient chunk size')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic data after the run')
+
+    def handle(self, *args, **options):
+        total = options['clients']
+        newsletter = self.seed(total)
+        try:
+            self.measure(newsletter, total, options['chunk_size'])
+        finally:
+            if not options['keep']:
+                self.cleanup(newsletter)
+
+    def seed(self, total, batch=10_000):
+        self.stdout.write(f'Seeding {total} clients')
+        message = Message.objects.create(topic=BENCH_TAG, content=BENCH_TAG)
+        # bulk_create skips Newsletter.save, so no SEND task is queued for the scheduler to pick up
+        newsletter, = Newsletter.objects.bulk_create([Newsletter(initial=timezone.now(), status='S', message=message)])
+        Through = Newsletter.clients.through
+        for start in range(0, total, batch):
+            clients = Client.objects.bulk_create(
+                Client(email=f'client{i}@example{i % 10}.test', full_name=f'Client {i}', comment=BENCH_TAG)
+                for i in range(start, min(start + batch, total))
+            )
+            Through.objects.bulk_create(
+                Through(newsletter_id=newsletter.pk, client_id=client.pk) for client in clients
+            )
+        return newsletter
+
+    def cleanup(self, newsletter):
+        self.stdout.write('Removing synthetic data')
+        # Raw deletes send no per-row signals, which would bump the statistics
+        # and the list version once per client; they are recounted at the end
+        Through = Newsletter.clients.through
+        Through.objects.filter(newsletter_id=newsletter.pk)._raw_delete(Through.objects.db)
+        Newsletter.objects.filter(pk=newsletter.pk).delete()
+        Message.objects.filter(topic=BENCH_TAG).delete()
+        Client.objects.filter(comment=BENCH_TAG)._raw_delete(Client.objects.db)
+        reconcile_stats()
+
+    def measure(self, newsletter, total, chunk_size):
+        step = max(total // 10, 1)
+        kwargs = {'chunk_size': chunk_size} if chunk_size else {}
+        count = 0
+
+        tracemalloc.start()
+        started = time.monotonic()
+        for _ in iter_recipients(newsletter, **kwargs):
+            count += 1
+            if count % step == 0:
+                current, peak = tracemalloc.get_traced_memory()
+                self.stdout.write(f'{count:>10} rows  current {current / 1024:>8.0f} KiB  peak {peak / 1024:>8.0f} KiB')
+        elapsed = time.monotonic() - started
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Streamed {count} recipients in {elapsed:.1f}s, peak traced memory {peak / 1024:.0f} KiB'
+        ))
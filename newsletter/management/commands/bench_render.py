@@ -0,0 +1,76 @@
+import time
+import tracemalloc
+from collections import namedtuple
+
+from django.core.mail import EmailMessage
+from django.core.management import BaseCommand
+from django.template import Context, Template
+
+from newsletter.rendering import RenderedMessage
+
+Recipient = namedtuple('Recipient', 'id email full_name')
+
+SUBJECT = 'Еженедельная рассылка'
+PARAGRAPH = 'Пример текста рассылки, который повторяется для объёма письма.\n'
+GREETING = 'Здравствуйте, {{ full_name }}! Письмо отправлено на {{ email }}.\n'
+
+
+class Command(BaseCommand):
+    help = 'Compare per-message CPU time and allocations of naive and pre-rendered newsletter emails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=5_000, help='Messages to render per variant')
+        parser.add_argument('--body-size', type=int, default=20_000, help='Approximate body size in characters')
+        parser.add_argument('--sample', type=int, default=500, help='Messages traced for allocations')
+        parser.add_argument('--personalized', action='store_true',
+                            help='Add client placeholders; the naive variant renders them with the template engine')
+
+    def handle(self, *args, **options):
+        body = PARAGRAPH * max(options['body_size'] // len(PARAGRAPH), 1)
+        if options['personalized']:
+            body = GREETING + body
+        rendered = RenderedMessage(SUBJECT, body)
+        template = Template(body)
+
+        def recipient(i):
+            return Recipient(i, f'client{i}@example.com', f'Клиент {i}')
+
+        def naive(i):
+            client = recipient(i)
+            text = template.render(Context(client._asdict())) if options['personalized'] else body
+            email = EmailMessage(SUBJECT, text, to=[client.email])
+            return email.message().as_bytes(linesep='\r\n')
+
+        def prerendered(i):
+            return rendered.for_recipient(recipient(i)).message().as_bytes(linesep='\r\n')
+
+        results = {}
+        for name, render in (('naive', naive), ('pre-rendered', prerendered)):
+            cpu = self.cpu_per_message(render, options['messages'])
+            allocated = self.bytes_per_message(render, options['sample'])
+            results[name] = (cpu, allocated)
+            self.stdout.write(f'{name:>13}: {cpu * 1e6:8.1f} us CPU/message, {allocated / 1024:8.1f} KiB allocated/message')
+
+        naive_cpu, naive_allocated = results['naive']
+        cpu, allocated = results['pre-rendered']
+        self.stdout.write(self.style.SUCCESS(
+            f'Pre-rendering: {naive_cpu / cpu:.1f}x less CPU, {naive_allocated / allocated:.1f}x fewer bytes allocated'
+        ))
+
+    def cpu_per_message(self, render, count):
+        started = time.process_time()
+        for i in range(count):
+            render(i)
+        return (time.process_time() - started) / count
+
+    def bytes_per_message(self, render, count):
+        total = 0
+        tracemalloc.start()
+        for i in range(count):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            render(i)
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - baseline
+        tracemalloc.stop()
+        return total / count
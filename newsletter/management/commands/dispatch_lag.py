@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from newsletter.models import DispatchTask
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = 'Print scheduling lag percentiles of the dispatch tasks finished in a time window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help='Size of the window, counting back from now')
+        parser.add_argument('--kind', choices=[kind for kind, _ in DispatchTask.KIND], help='Only this kind of task')
+
+    def handle(self, *args, **options):
+        tasks = DispatchTask.objects.filter(
+            finished_at__gte=timezone.now() - timedelta(hours=options['hours']), started_at__isnull=False
+        )
+        if options['kind']:
+            tasks = tasks.filter(kind=options['kind'])
+        rows = list(tasks.values_list('due_at', 'locked_at', 'started_at', 'finished_at', 'state', 'recipients'))
+        if not rows:
+            self.stdout.write('No finished dispatch tasks in the window')
+            return
+
+        series = {
+            'lag': sorted((started - due).total_seconds() for due, _, started, _, _, _ in rows),
+            'poll delay': sorted((locked - due).total_seconds() for due, locked, _, _, _, _ in rows),
+            'queue wait': sorted((started - locked).total_seconds() for _, locked, started, _, _, _ in rows),
+            'run': sorted((finished - started).total_seconds() for _, _, started, finished, _, _ in rows),
+        }
+        misfires = sum(1 for row in rows if row[4] == 'M')
+        failures = sum(1 for row in rows if row[4] == 'F')
+        recipients = sum(row[5] for row in rows)
+
+        self.stdout.write(f'{len(rows)} tasks, {misfires} misfired, {failures} failed, {recipients} recipients')
+        self.stdout.write(f'{"seconds":<12}{"p50":>10}{"p90":>10}{"p99":>10}{"max":>10}')
+        for name, values in series.items():
+            self.stdout.write(f'{name:<12}' + ''.join(
+                f'{percentile(values, fraction):>10.2f}' for fraction in (0.5, 0.9, 0.99)
+            ) + f'{values[-1]:>10.2f}')
@@ -0,0 +1,52 @@
+import logging
+import time
+
+from django.core.management import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from config.settings import NEWSLETTER_SCHEDULER_LEASE, NEWSLETTER_METRICS_PORT
+from newsletter.metrics import serve_metrics
+from newsletter.scheduler import acquire_lease, release_lease, start_scheduler
+from newsletter.sharding import worker_name
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run the newsletter scheduler; start one per node, only the holder of the lease schedules sends'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--metrics-port', type=int, default=NEWSLETTER_METRICS_PORT,
+                            help='Serve scheduling metrics on this port at /metrics, 0 to disable')
+
+    def handle(self, *args, **options):
+        holder = worker_name()
+        scheduler = None
+        self.stdout.write(f'Scheduler {holder} started')
+        if options['metrics_port']:
+            serve_metrics(options['metrics_port'])
+            self.stdout.write(f'Serving metrics on port {options["metrics_port"]}')
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    leader = acquire_lease(holder)
+                except DatabaseError as e:
+                    logger.error(f"Could not renew the scheduler lease: {e}")
+                    leader = False
+
+                if leader and scheduler is None:
+                    scheduler = start_scheduler()
+                    self.stdout.write(f'Scheduler {holder} took the lease')
+                elif not leader and scheduler is not None:
+                    scheduler.shutdown(wait=False)
+                    scheduler = None
+                    self.stdout.write(f'Scheduler {holder} lost the lease')
+
+                time.sleep(NEWSLETTER_SCHEDULER_LEASE / 3)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if scheduler is not None:
+                scheduler.shutdown()
+                release_lease(holder)
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management import BaseCommand
+
+from newsletter.ratelimit import QuotaExceeded
+from newsletter.sharding import worker_name, work_shards
+
+
+class Command(BaseCommand):
+    help = 'Claim and send newsletter shards; run as many of these as needed on any node'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit as soon as no shard is left')
+        parser.add_argument('--poll', type=float, default=5, help='Seconds to wait when no shard is available')
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        self.stdout.write(f'Shard worker {worker} started')
+        while True:
+            try:
+                taken = work_shards(worker)
+            except QuotaExceeded as e:
+                # The owner's shards wait for the quota, other owners' go on
+                self.stdout.write(f'{e}, deferring its shards until {e.resume_at}')
+                continue
+            if taken:
+                self.stdout.write(f'Processed {taken} shards')
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['poll'])
@@ -9,58 +9,52 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('newsletter_id', type=int, help='ID of the newsletter to send')
+        parser.add_argument('--resume', action='store_true',
+                            help='Carry on with the current run instead of starting a new one')
 
     def handle(self, *args, **kwargs):
         newsletter_id = kwargs['newsletter_id']
-        send_newsletter(newsletter_id)
+        send_newsletter(newsletter_id, resume=kwargs['resume'])
 
-def send_newsletter(newsletter_id):
+def send_newsletter(newsletter_id, resume=False):
+    from django.db.models import F
     from django.utils import timezone
-    from django.core.mail import send_mail
-    from config.settings import EMAIL_HOST_USER
+    from newsletter.cancellation import RunCancelled
+    from newsletter.delivery import deliver_newsletter, set_run_status, DuplicateRun
+    from newsletter.ratelimit import QuotaExceeded
+    from newsletter.sharding import plan_shards, work_shards
 
     Newsletter = apps.get_model('newsletter', 'Newsletter')
-    Attempt = apps.get_model('newsletter', 'Attempt')
     try:
+        if not resume:
+            Newsletter.objects.filter(id=newsletter_id).update(
+                run=F('run') + 1, run_started_at=timezone.now(), status='P'
+            )
         newsletter = Newsletter.objects.get(id=newsletter_id)
-        logger.info(f"Sending newsletter {newsletter_id} to clients")
-        for client in newsletter.clients.all():
-            logger.info(f"Sending email to {client.email}")
-            try:
-                send_mail(
-                    newsletter.message.topic,
-                    newsletter.message.content,
-                    from_email=EMAIL_HOST_USER,
-                    recipient_list=[client.email],
-                )
-                Attempt.objects.create(
-                    newsletter=newsletter,
-                    client=client,
-                    message=newsletter.message,
-                    last_attempt_time=timezone.now(),
-                    last_attempt_status='S',
-                    server_response=200
-                )
-                logger.info(f"Attempt successful for {client.email}")
-            except Exception as e:
-                Attempt.objects.create(
-                    newsletter=newsletter,
-                    client=client,
-                    message=newsletter.message,
-                    last_attempt_time=timezone.now(),
-                    last_attempt_status='F',
-                    server_response=500
-                )
-                logger.error(f"Attempt failed for {client.email}: {e}")
-        newsletter.status = 'S'
-        newsletter.save()
+        if plan_shards(newsletter):
+            work_shards(newsletter_id=newsletter.id)
+            return
+        deliver_newsletter(newsletter)
+        set_run_status(newsletter, 'S')
 
     except Newsletter.DoesNotExist:
         logger.error(f"Newsletter {newsletter_id} does not exist")
         raise CommandError(f'Newsletter with id {newsletter_id} does not exist')
 
+    except DuplicateRun as e:
+        logger.warning(f"Skipping newsletter {newsletter_id}: {e}")
+        raise CommandError(str(e))
+
+    except QuotaExceeded as e:
+        logger.info(str(e))
+        raise CommandError(f"{e}, try again after {e.resume_at}")
+
+    except RunCancelled as e:
+        set_run_status(newsletter, 'C')
+        logger.info(str(e))
+        raise CommandError(str(e))
+
     except Exception as e:
-        newsletter.status = 'F'
-        newsletter.save()
+        set_run_status(newsletter, 'F')
         logger.error(f"Error sending newsletter {newsletter_id}: {e}")
-        raise CommandError(f"Error sending newsletter {newsletter_id}: {e}")
\ No newline at end of file
+        raise CommandError(f"Error sending newsletter {newsletter_id}: {e}")
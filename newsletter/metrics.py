@@ -0,0 +1,116 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter:
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        for bound, count in zip(self.buckets, self.counts):
+            yield f'{name}_bucket', labels + (('le', str(bound)),), count
+        yield f'{name}_bucket', labels + (('le', '+Inf'),), self.count
+        yield f'{name}_sum', labels, self.sum
+        yield f'{name}_count', labels, self.count
+
+
+class Registry:
+    """
+    Thread-safe in-process store of counters and histograms, rendered in
+    the Prometheus text format by ``render()``.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _update(self, factory, name, help_text, labels, update):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = factory()
+                self._help[name] = (type(metric).__name__.lower(), help_text)
+            update(metric)
+
+    def inc(self, name, help_text, amount=1, **labels):
+        self._update(Counter, name, help_text, labels, lambda metric: metric.inc(amount))
+
+    def observe(self, name, help_text, value, buckets=LATENCY_BUCKETS, **labels):
+        self._update(lambda: Histogram(buckets), name, help_text, labels, lambda metric: metric.observe(value))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            described = set()
+            for (name, labels), metric in sorted(self._metrics.items()):
+                if name not in described:
+                    kind, help_text = self._help[name]
+                    lines.append(f'# HELP {name} {help_text}')
+                    lines.append(f'# TYPE {name} {kind}')
+                    described.add(name)
+                for sample, sample_labels, value in metric.samples(name, labels):
+                    label_text = ','.join(f'{key}="{val}"' for key, val in sample_labels)
+                    lines.append(f'{sample}{{{label_text}}} {value}' if label_text else f'{sample} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+            self._help.clear()
+
+
+registry = Registry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port, host='0.0.0.0'):
+    """Serves ``/metrics`` from a daemon thread; returns the server so it can be shut down."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='newsletter-metrics', daemon=True).start()
+    return server
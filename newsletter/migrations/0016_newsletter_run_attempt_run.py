@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0015_newsletter_end_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attempt',
+            name='run',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='newsletter',
+            name='run',
+            field=models.PositiveIntegerField(default=1, verbose_name='номер запуска'),
+        ),
+        migrations.AddConstraint(
+            model_name='attempt',
+            constraint=models.UniqueConstraint(fields=('newsletter', 'run', 'client'), name='unique_attempt_per_run'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0016_newsletter_run_attempt_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attempt',
+            name='next_retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='retries',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='newsletter',
+            name='max_attempts',
+            field=models.PositiveSmallIntegerField(default=3, verbose_name='максимум попыток'),
+        ),
+        migrations.AddIndex(
+            model_name='attempt',
+            index=models.Index(condition=models.Q(('next_retry_at__isnull', False)), fields=['newsletter', 'next_retry_at'], name='attempt_retry_due_idx'),
+        ),
+    ]
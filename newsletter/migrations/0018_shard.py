@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0017_attempt_retries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Shard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run', models.PositiveIntegerField(verbose_name='номер запуска')),
+                ('first_client_id', models.BigIntegerField(verbose_name='первый клиент')),
+                ('last_client_id', models.BigIntegerField(verbose_name='последний клиент')),
+                ('size', models.PositiveIntegerField(verbose_name='получателей')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='обработано')),
+                ('state', models.CharField(choices=[('W', 'Waiting'), ('R', 'Running'), ('S', 'Successful'), ('F', 'Failed')], default='W', max_length=2, verbose_name='состояние')),
+                ('claimed_by', models.CharField(blank=True, max_length=150, null=True, verbose_name='обработчик')),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True, verbose_name='последняя активность')),
+                ('newsletter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='newsletter.newsletter', verbose_name='рассылка')),
+            ],
+            options={
+                'verbose_name': 'часть рассылки',
+                'verbose_name_plural': 'части рассылки',
+                'indexes': [models.Index(fields=['state', 'heartbeat_at'], name='shard_claim_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shard',
+            constraint=models.UniqueConstraint(fields=('newsletter', 'run', 'first_client_id'), name='unique_shard_per_run'),
+        ),
+    ]
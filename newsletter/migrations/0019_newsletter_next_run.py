@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+def schedule_pending(apps, schema_editor):
+    Newsletter = apps.get_model('newsletter', 'Newsletter')
+    DjangoJob = apps.get_model('django_apscheduler', 'DjangoJob')
+    Newsletter.objects.filter(status='P', finished=False).update(next_run_at=models.F('initial'))
+    DjangoJob.objects.filter(id__startswith='send-newsletter-').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0018_shard'),
+        ('django_apscheduler', '0009_djangojobexecution_unique_job_executions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletter',
+            name='last_run_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='последняя отправка'),
+        ),
+        migrations.AddField(
+            model_name='newsletter',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='следующая отправка'),
+        ),
+        migrations.AddIndex(
+            model_name='newsletter',
+            index=models.Index(condition=models.Q(('next_run_at__isnull', False)), fields=['next_run_at'], name='newsletter_due_idx'),
+        ),
+        migrations.RunPython(schedule_pending, migrations.RunPython.noop),
+    ]
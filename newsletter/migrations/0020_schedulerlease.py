@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0019_newsletter_next_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='имя')),
+                ('holder', models.CharField(max_length=150, verbose_name='владелец')),
+                ('expires_at', models.DateTimeField(verbose_name='действует до')),
+            ],
+            options={
+                'verbose_name': 'аренда планировщика',
+                'verbose_name_plural': 'аренды планировщика',
+            },
+        ),
+    ]
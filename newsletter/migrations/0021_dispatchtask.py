@@ -0,0 +1,81 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:20
+
+from django.db import migrations, models
+from django.db.models import Min
+import django.db.models.deletion
+
+
+def queue_tasks(apps, schema_editor):
+    Newsletter = apps.get_model('newsletter', 'Newsletter')
+    Attempt = apps.get_model('newsletter', 'Attempt')
+    DispatchTask = apps.get_model('newsletter', 'DispatchTask')
+    DjangoJob = apps.get_model('django_apscheduler', 'DjangoJob')
+
+    sends = Newsletter.objects.filter(next_run_at__isnull=False, finished=False).values_list('id', 'next_run_at')
+    retries = (
+        Attempt.objects
+        .filter(last_attempt_status='F', next_retry_at__isnull=False)
+        .values('newsletter_id')
+        .annotate(due_at=Min('next_retry_at'))
+        .values_list('newsletter_id', 'due_at')
+    )
+    DispatchTask.objects.bulk_create(
+        [DispatchTask(newsletter_id=newsletter_id, kind='S', due_at=due_at) for newsletter_id, due_at in sends]
+        + [DispatchTask(newsletter_id=newsletter_id, kind='R', due_at=due_at) for newsletter_id, due_at in retries],
+        batch_size=1000
+    )
+    DjangoJob.objects.filter(id__startswith='retry-newsletter-').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0020_schedulerlease'),
+        ('django_apscheduler', '0009_djangojobexecution_unique_job_executions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DispatchTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('S', 'Send'), ('R', 'Retry')], max_length=1, verbose_name='тип')),
+                ('due_at', models.DateTimeField(verbose_name='срок')),
+                ('state', models.CharField(choices=[('W', 'Waiting'), ('R', 'Running'), ('D', 'Done'), ('F', 'Failed')], default='W', max_length=1, verbose_name='состояние')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='попыток')),
+                ('locked_by', models.CharField(blank=True, max_length=150, null=True, verbose_name='обработчик')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='взята в работу')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='завершена')),
+            ],
+            options={
+                'verbose_name': 'задача отправки',
+                'verbose_name_plural': 'задачи отправки',
+            },
+        ),
+        migrations.AddField(
+            model_name='dispatchtask',
+            name='newsletter',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='newsletter.newsletter', verbose_name='рассылка'),
+        ),
+        migrations.AddIndex(
+            model_name='dispatchtask',
+            index=models.Index(condition=models.Q(('state', 'W')), fields=['due_at'], name='task_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dispatchtask',
+            index=models.Index(condition=models.Q(('state', 'R')), fields=['locked_at'], name='task_running_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dispatchtask',
+            constraint=models.UniqueConstraint(condition=models.Q(('state', 'W')), fields=('newsletter', 'kind'), name='unique_waiting_task'),
+        ),
+        migrations.RunPython(queue_tasks, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='newsletter',
+            name='newsletter_due_idx',
+        ),
+        migrations.RemoveField(
+            model_name='newsletter',
+            name='next_run_at',
+        ),
+    ]
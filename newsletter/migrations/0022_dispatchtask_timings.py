@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0021_dispatchtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispatchtask',
+            name='recipients',
+            field=models.PositiveIntegerField(default=0, verbose_name='получателей'),
+        ),
+        migrations.AddField(
+            model_name='dispatchtask',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='начата'),
+        ),
+        migrations.AlterField(
+            model_name='dispatchtask',
+            name='state',
+            field=models.CharField(choices=[('W', 'Waiting'), ('R', 'Running'), ('D', 'Done'), ('M', 'Misfired'), ('F', 'Failed')], default='W', max_length=1, verbose_name='состояние'),
+        ),
+        migrations.AddIndex(
+            model_name='dispatchtask',
+            index=models.Index(condition=models.Q(('finished_at__isnull', False)), fields=['finished_at'], name='task_finished_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:22
+
+from django.db import migrations, models
+
+
+def copy_locked_at(apps, schema_editor):
+    DispatchTask = apps.get_model('newsletter', 'DispatchTask')
+    DispatchTask.objects.filter(state='R').update(heartbeat_at=models.F('locked_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0022_dispatchtask_timings'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='dispatchtask',
+            name='task_running_idx',
+        ),
+        migrations.AddField(
+            model_name='dispatchtask',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='последняя активность'),
+        ),
+        migrations.AddField(
+            model_name='newsletter',
+            name='send_window',
+            field=models.PositiveIntegerField(blank=True, help_text='Растянуть отправку на указанное число минут', null=True, verbose_name='окно отправки, минут'),
+        ),
+        migrations.AddIndex(
+            model_name='dispatchtask',
+            index=models.Index(condition=models.Q(('state', 'R')), fields=['heartbeat_at'], name='task_running_idx'),
+        ),
+        migrations.RunPython(copy_locked_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0023_newsletter_send_window'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='newsletter',
+            name='status',
+            field=models.CharField(choices=[('S', 'Successful'), ('P', 'In Process'), ('F', 'Failed'), ('C', 'Cancelled')], default='P', max_length=2, verbose_name='статус'),
+        ),
+        migrations.AlterField(
+            model_name='shard',
+            name='state',
+            field=models.CharField(choices=[('W', 'Waiting'), ('R', 'Running'), ('S', 'Successful'), ('F', 'Failed'), ('C', 'Cancelled')], default='W', max_length=2, verbose_name='состояние'),
+        ),
+    ]
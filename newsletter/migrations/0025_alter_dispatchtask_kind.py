@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0024_cancelled_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dispatchtask',
+            name='kind',
+            field=models.CharField(choices=[('S', 'Send'), ('R', 'Retry'), ('C', 'Resume')], max_length=1, verbose_name='тип'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:32
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def count_stats(apps, schema_editor):
+    Newsletter = apps.get_model('newsletter', 'Newsletter')
+    Client = apps.get_model('newsletter', 'Client')
+    Statistic = apps.get_model('newsletter', 'Statistic')
+
+    now = timezone.now()
+    Statistic.objects.bulk_create([
+        Statistic(name='newsletters', value=Newsletter.objects.count()),
+        Statistic(name='active_newsletters',
+                  value=Newsletter.objects.filter(initial__lte=now, end_date__gte=now, finished=False).count()),
+        Statistic(name='clients', value=Client.objects.count()),
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0025_alter_dispatchtask_kind'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Statistic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='показатель')),
+                ('value', models.IntegerField(default=0, verbose_name='значение')),
+            ],
+            options={
+                'verbose_name': 'статистика',
+                'verbose_name_plural': 'статистика',
+            },
+        ),
+        migrations.RunPython(count_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0026_statistic'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shard',
+            name='not_before',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='не раньше'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0027_shard_not_before'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletter',
+            name='run_started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='начало запуска'),
+        ),
+    ]
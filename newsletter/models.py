@@ -1,17 +1,28 @@
+import calendar
 import logging
-import pytz
-from django.db import models
+from datetime import timedelta
+
+from django.db import models, transaction
 from django.utils import timezone
-from django_apscheduler.models import DjangoJob
 
+from config.settings import NEWSLETTER_MISFIRE_GRACE
+from newsletter.cancellation import request_cancel, clear_cancel
+from newsletter.dispatch import SEND, RETRY, RESUME, enqueue, dequeue
 from users.models import User
-from .scheduler import send_newsletter, scheduler
 
 logger = logging.getLogger(__name__)
 
 NULLABLE = {'null': True, 'blank': True}
 
 
+def add_months(moment, months):
+    month = moment.month - 1 + months
+    year = moment.year + month // 12
+    month = month % 12 + 1
+    day = min(moment.day, calendar.monthrange(year, month)[1])
+    return moment.replace(year=year, month=month, day=day)
+
+
 class Client(models.Model):
     email = models.EmailField(verbose_name='почта')
     full_name = models.CharField(max_length=50, **NULLABLE, verbose_name='имя')
@@ -39,11 +50,38 @@ class Message(models.Model):
         return self.topic
 
 
+class NewsletterQuerySet(models.QuerySet):
+
+    def reschedule(self):
+        """
+        Replaces the waiting send tasks of every newsletter in the queryset
+        with one delete and one bulk_create.
+        """
+        now = timezone.now()
+        newsletters = list(self.only('id', 'last_run_at', *self.model.SCHEDULE_FIELDS))
+        tasks = []
+        for newsletter in newsletters:
+            next_run = newsletter.compute_next_run(now)
+            if next_run is not None:
+                tasks.append(DispatchTask(newsletter=newsletter, kind=SEND, due_at=next_run))
+        with transaction.atomic():
+            DispatchTask.objects.filter(newsletter__in=newsletters, kind=SEND, state='W').delete()
+            DispatchTask.objects.bulk_create(tasks, batch_size=1000)
+        return len(newsletters)
+
+
 class Newsletter(models.Model):
+    # Saves that leave these unchanged do not write them, so they cannot undo a concurrent change
+    SCHEDULE_FIELDS = ('initial', 'end_date', 'frequency', 'finished')
+    # Written by the scheduler only, with update(); saves of an existing
+    # newsletter never write them unless named in update_fields
+    SCHEDULER_FIELDS = ('last_run_at', 'run_started_at', 'run', 'status')
+
     STATUS = [
         ('S', 'Successful'),
         ('P', 'In Process'),
         ('F', 'Failed'),
+        ('C', 'Cancelled'),
     ]
     FREQ_OPTIONS = [
         ('D', 'Daily'),
@@ -58,31 +96,99 @@ class Newsletter(models.Model):
     message = models.ForeignKey(Message, on_delete=models.CASCADE, verbose_name='сообщение')
     clients = models.ManyToManyField(Client, verbose_name='клиенты')
     user = models.ForeignKey(User, verbose_name='создатель', blank=True, null=True, on_delete=models.CASCADE)
+    run = models.PositiveIntegerField(default=1, verbose_name='номер запуска')
+    max_attempts = models.PositiveSmallIntegerField(default=3, verbose_name='максимум попыток')
+    last_run_at = models.DateTimeField(**NULLABLE, verbose_name='последняя отправка')
+    run_started_at = models.DateTimeField(**NULLABLE, verbose_name='начало запуска')
+    send_window = models.PositiveIntegerField(**NULLABLE, verbose_name='окно отправки, минут',
+                                              help_text='Растянуть отправку на указанное число минут')
+
+    objects = NewsletterQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_schedule = instance.schedule()
+        return instance
+
+    def schedule(self):
+        """Loaded values of the fields the send times depend on; deferred ones are not fetched."""
+        return {name: self.__dict__[name] for name in self.SCHEDULE_FIELDS if name in self.__dict__}
 
+    def schedule_changed(self):
+        saved = getattr(self, '_saved_schedule', None)
+        if saved is None:
+            return True
+        return any(name not in saved or saved[name] != value for name, value in self.schedule().items())
 
     def save(self, *args, **kwargs):
+        was_finished = getattr(self, '_saved_schedule', {}).get('finished', False)
+        changed = self.schedule_changed()
+        if kwargs.get('update_fields') is None and not self._state.adding:
+            skipped = self.SCHEDULER_FIELDS if changed else self.SCHEDULE_FIELDS + self.SCHEDULER_FIELDS
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred and field.name not in skipped
+            ]
         super().save(*args, **kwargs)
-        if self.status == 'P':
-            job_id = f'send-newsletter-{self.id}'
-            logger.info(f"Scheduling job {job_id} for {self.initial}")
-
-            try:
-                existing_job = DjangoJob.objects.get(id=job_id)
-                scheduler.remove_job(job_id)
-                existing_job.delete()
-                logger.info(f"Removed existing job {job_id}")
-            except DjangoJob.DoesNotExist:
-                pass
-
-            scheduler.add_job(
-                send_newsletter,
-                trigger='date',
-                run_date=self.initial.astimezone(pytz.UTC),
-                args=[self.id],
-                id=job_id,
-                replace_existing=True
-            )
-            logger.info(f"Scheduled new job {job_id} to run at {self.initial.astimezone(pytz.UTC)}")
+        self._saved_schedule = self.schedule()
+        if changed:
+            self.reschedule()
+            if self.finished and not was_finished:
+                request_cancel(self.id)
+            elif was_finished and not self.finished:
+                clear_cancel(self.id)
+
+    def reschedule(self):
+        next_run = self.compute_next_run()
+        if next_run is None:
+            dequeue(self.id, SEND)
+        else:
+            enqueue(self.id, SEND, next_run)
+        logger.info(f"Newsletter {self.id} is due at {next_run}")
+
+    def occurrence(self, number):
+        """Start of the ``number``-th send, counted from ``initial`` in local time."""
+        initial = timezone.localtime(self.initial)
+        if self.frequency == 'D':
+            moment = initial.replace(tzinfo=None) + timedelta(days=number)
+        elif self.frequency == 'W':
+            moment = initial.replace(tzinfo=None) + timedelta(weeks=number)
+        else:
+            moment = add_months(initial.replace(tzinfo=None), number)
+        return timezone.make_aware(moment, initial.tzinfo)
+
+    def compute_next_run(self, now=None):
+        """
+        First occurrence that has not been sent yet and is not older than
+        NEWSLETTER_MISFIRE_GRACE, or None once the newsletter is finished or
+        past its ``end_date``.
+        """
+        if self.finished:
+            return None
+        after = (now or timezone.now()) - timedelta(seconds=NEWSLETTER_MISFIRE_GRACE)
+        if self.last_run_at is not None and self.last_run_at >= after:
+            after = self.last_run_at + timedelta(microseconds=1)
+
+        if after <= self.initial:
+            number = 0
+        elif self.frequency == 'D':
+            number = -(-(after - self.initial) // timedelta(days=1))
+        elif self.frequency == 'W':
+            number = -(-(after - self.initial) // timedelta(weeks=1))
+        else:
+            local_after, initial = timezone.localtime(after), timezone.localtime(self.initial)
+            number = max((local_after.year - initial.year) * 12 + local_after.month - initial.month, 0)
+        # Local time arithmetic can land an hour off around DST changes
+        number = max(number - 1, 0)
+        while self.occurrence(number) < after:
+            number += 1
+
+        next_run = self.occurrence(number)
+        if self.end_date is not None and next_run > self.end_date:
+            return None
+        return next_run
 
     def is_active(self):
         now = timezone.now()
@@ -119,10 +225,121 @@ class Attempt(models.Model):
     last_attempt_time = models.DateTimeField()
     last_attempt_status = models.CharField(max_length=2, choices=STATUS, default='S')
     server_response = models.IntegerField(default=200)
+    run = models.PositiveIntegerField(**NULLABLE)
+    retries = models.PositiveSmallIntegerField(default=0)
+    next_retry_at = models.DateTimeField(**NULLABLE)
 
     class Meta:
         verbose_name = 'попытка'
         verbose_name_plural = 'попытки'
+        constraints = [
+            models.UniqueConstraint(fields=['newsletter', 'run', 'client'], name='unique_attempt_per_run'),
+        ]
+        indexes = [
+            models.Index(fields=['newsletter', 'next_retry_at'], condition=models.Q(next_retry_at__isnull=False),
+                         name='attempt_retry_due_idx'),
+        ]
 
     def __str__(self):
         return f"{self.newsletter} to {self.client} at {self.last_attempt_time} - {self.last_attempt_status}"
+
+
+class Shard(models.Model):
+    STATE = [
+        ('W', 'Waiting'),
+        ('R', 'Running'),
+        ('S', 'Successful'),
+        ('F', 'Failed'),
+        ('C', 'Cancelled'),
+    ]
+    newsletter = models.ForeignKey(Newsletter, on_delete=models.CASCADE, related_name='shards', verbose_name='рассылка')
+    run = models.PositiveIntegerField(verbose_name='номер запуска')
+    first_client_id = models.BigIntegerField(verbose_name='первый клиент')
+    last_client_id = models.BigIntegerField(verbose_name='последний клиент')
+    size = models.PositiveIntegerField(verbose_name='получателей')
+    processed = models.PositiveIntegerField(default=0, verbose_name='обработано')
+    state = models.CharField(max_length=2, choices=STATE, default='W', verbose_name='состояние')
+    claimed_by = models.CharField(max_length=150, **NULLABLE, verbose_name='обработчик')
+    heartbeat_at = models.DateTimeField(**NULLABLE, verbose_name='последняя активность')
+    not_before = models.DateTimeField(**NULLABLE, verbose_name='не раньше')
+
+    class Meta:
+        verbose_name = 'часть рассылки'
+        verbose_name_plural = 'части рассылки'
+        constraints = [
+            models.UniqueConstraint(fields=['newsletter', 'run', 'first_client_id'], name='unique_shard_per_run'),
+        ]
+        indexes = [
+            models.Index(fields=['state', 'heartbeat_at'], name='shard_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.newsletter_id} run {self.run}: clients {self.first_client_id}-{self.last_client_id}"
+
+
+class SchedulerLease(models.Model):
+    name = models.CharField(max_length=50, unique=True, verbose_name='имя')
+    holder = models.CharField(max_length=150, verbose_name='владелец')
+    expires_at = models.DateTimeField(verbose_name='действует до')
+
+    class Meta:
+        verbose_name = 'аренда планировщика'
+        verbose_name_plural = 'аренды планировщика'
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder} until {self.expires_at}"
+
+
+class DispatchTask(models.Model):
+    KIND = [
+        (SEND, 'Send'),
+        (RETRY, 'Retry'),
+        (RESUME, 'Resume'),
+    ]
+    STATE = [
+        ('W', 'Waiting'),
+        ('R', 'Running'),
+        ('D', 'Done'),
+        ('M', 'Misfired'),
+        ('F', 'Failed'),
+    ]
+    newsletter = models.ForeignKey(Newsletter, on_delete=models.CASCADE, related_name='tasks', verbose_name='рассылка')
+    kind = models.CharField(max_length=1, choices=KIND, verbose_name='тип')
+    due_at = models.DateTimeField(verbose_name='срок')
+    state = models.CharField(max_length=1, choices=STATE, default='W', verbose_name='состояние')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='попыток')
+    locked_by = models.CharField(max_length=150, **NULLABLE, verbose_name='обработчик')
+    locked_at = models.DateTimeField(**NULLABLE, verbose_name='взята в работу')
+    heartbeat_at = models.DateTimeField(**NULLABLE, verbose_name='последняя активность')
+    started_at = models.DateTimeField(**NULLABLE, verbose_name='начата')
+    finished_at = models.DateTimeField(**NULLABLE, verbose_name='завершена')
+    recipients = models.PositiveIntegerField(default=0, verbose_name='получателей')
+
+    class Meta:
+        verbose_name = 'задача отправки'
+        verbose_name_plural = 'задачи отправки'
+        constraints = [
+            models.UniqueConstraint(fields=['newsletter', 'kind'], condition=models.Q(state='W'),
+                                    name='unique_waiting_task'),
+        ]
+        indexes = [
+            models.Index(fields=['due_at'], condition=models.Q(state='W'), name='task_due_idx'),
+            models.Index(fields=['heartbeat_at'], condition=models.Q(state='R'), name='task_running_idx'),
+            models.Index(fields=['finished_at'], condition=models.Q(finished_at__isnull=False),
+                         name='task_finished_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} newsletter {self.newsletter_id} at {self.due_at} - {self.state}"
+
+
+class Statistic(models.Model):
+    name = models.CharField(max_length=50, unique=True, verbose_name='показатель')
+    value = models.IntegerField(default=0, verbose_name='значение')
+
+    class Meta:
+        verbose_name = 'статистика'
+        verbose_name_plural = 'статистика'
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
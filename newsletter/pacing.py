@@ -0,0 +1,70 @@
+import logging
+import threading
+import time
+
+from config.settings import NEWSLETTER_PACING_BURST
+from newsletter.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+RATIO_BUCKETS = (0.5, 0.8, 0.9, 0.95, 1, 1.05, 1.1, 1.25, 1.5, 2)
+
+
+class TokenBucket:
+    """
+    ``rate`` tokens per second, at most ``capacity`` saved up. ``take()``
+    goes into debt and sleeps it off, so callers are released in order.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, count=1):
+        """Takes ``count`` tokens, sleeping until they are available; returns the seconds slept."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= count
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class Pacer:
+    """Releases ``total`` recipients evenly over ``window`` seconds in bursts of at most ``burst``."""
+
+    def __init__(self, total, window, burst=NEWSLETTER_PACING_BURST):
+        self.total = total
+        self.window = window
+        self.target_rate = max(total, 1) / window
+        self.bucket = TokenBucket(self.target_rate, burst)
+        self.released = 0
+        self.waited = 0
+        self._started = time.monotonic()
+
+    def release(self, count=1):
+        self.waited += self.bucket.take(count)
+        self.released += count
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self._started
+
+    @property
+    def actual_rate(self):
+        return self.released / self.elapsed if self.elapsed else 0
+
+    def report(self, newsletter_id):
+        ratio = self.actual_rate / self.target_rate
+        registry.observe('newsletter_pacing_ratio', 'Actual over target send rate of paced runs', ratio,
+                         buckets=RATIO_BUCKETS)
+        registry.inc('newsletter_pacing_wait_seconds_total', 'Time paced runs spent waiting for tokens', self.waited)
+        logger.info(f"Newsletter {newsletter_id}: paced {self.released}/{self.total} recipients over "
+                    f"{self.elapsed:.0f}s of a {self.window:.0f}s window, {self.actual_rate:.2f} msg/s "
+                    f"against a target of {self.target_rate:.2f} msg/s, waited {self.waited:.0f}s")
@@ -0,0 +1,150 @@
+import logging
+import time
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+from config.settings import NEWSLETTER_RATE_CACHE, NEWSLETTER_RATE_PER_SECOND, NEWSLETTER_RATE_PER_HOUR, \
+    NEWSLETTER_DOMAIN_RATE_PER_SECOND, NEWSLETTER_DOMAIN_RATE_PER_HOUR, NEWSLETTER_DOMAIN_RATES
+from newsletter.cache_backends import is_shared
+from newsletter.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SECOND = 1
+HOUR = 3600
+DAY = 86400
+
+
+class RateLimiter:
+    """
+    Messages-per-second and messages-per-hour budgets for all outbound mail
+    and for every recipient domain, shared by all threads and processes
+    through the cache.
+
+    Every budget is a counter per time slot of its period, taken with the
+    cache's atomic ``incr``; Django's cache API has no compare-and-set to
+    keep a continuous bucket consistent. A send that would overdraw any
+    budget gives back what it took and sleeps until that slot is over.
+    ``domain_rates`` maps a domain to its own ``(per_second, per_hour)``;
+    0 means no limit.
+    """
+
+    def __init__(self, per_second=NEWSLETTER_RATE_PER_SECOND, per_hour=NEWSLETTER_RATE_PER_HOUR,
+                 domain_per_second=NEWSLETTER_DOMAIN_RATE_PER_SECOND, domain_per_hour=NEWSLETTER_DOMAIN_RATE_PER_HOUR,
+                 domain_rates=NEWSLETTER_DOMAIN_RATES, cache_alias=NEWSLETTER_RATE_CACHE):
+        self.limits = [(limit, period) for limit, period in ((per_second, SECOND), (per_hour, HOUR)) if limit]
+        self.domain_limits = (domain_per_second, domain_per_hour)
+        self.domain_rates = {domain.lower(): tuple(rates) for domain, rates in domain_rates.items()}
+        self.cache_alias = cache_alias
+
+    @property
+    def enabled(self):
+        return bool(self.limits or any(self.domain_limits) or self.domain_rates)
+
+    def budgets(self, domain):
+        per_second, per_hour = self.domain_rates.get(domain, self.domain_limits)
+        yield from (('all', limit, period) for limit, period in self.limits)
+        yield from ((domain, limit, period) for limit, period in ((per_second, SECOND), (per_hour, HOUR)) if limit)
+
+    def _take(self, scope, limit, period, now):
+        cache = caches[self.cache_alias]
+        slot = int(now // period)
+        key = f'newsletter-rate:{scope}:{period}:{slot}'
+        cache.add(key, 0, timeout=period + 1)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # The slot expired between add() and incr()
+            cache.add(key, 0, timeout=period + 1)
+            count = cache.incr(key)
+        if count <= limit:
+            return key, 0
+        cache.decr(key)
+        return None, (slot + 1) * period - now
+
+    def reserve(self, domain):
+        """
+        Takes a message to ``domain`` from every budget and returns 0; if a
+        budget is spent, gives back what was taken and returns the seconds
+        until its slot is over.
+        """
+        now = time.time()
+        taken = []
+        for scope, limit, period in self.budgets(domain):
+            key, wait = self._take(scope, limit, period, now)
+            if key is None:
+                cache = caches[self.cache_alias]
+                for key in taken:
+                    cache.decr(key)
+                registry.inc('newsletter_rate_limit_wait_seconds_total', 'Time sends were held back by rate limits',
+                             wait, scope='all' if scope == 'all' else 'domain')
+                logger.debug(f"Rate limit of {scope} reached, waiting {wait:.2f}s")
+                return wait
+            taken.append(key)
+        return 0
+
+    def acquire(self, domain):
+        """Blocks until a message to ``domain`` fits every budget; returns the seconds waited."""
+        waited = 0
+        while wait := self.reserve(domain):
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+
+rate_limiter = RateLimiter()
+
+
+class QuotaExceeded(Exception):
+
+    def __init__(self, message, resume_at):
+        super().__init__(message)
+        self.resume_at = resume_at
+
+
+class SendQuota:
+    """
+    Hourly and daily send quotas of newsletter owners, counted per calendar
+    slot in the cache like the rate limits.
+    """
+
+    def __init__(self, cache_alias=NEWSLETTER_RATE_CACHE):
+        self.cache_alias = cache_alias
+
+    def _take(self, owner, count, limit, period, now):
+        cache = caches[self.cache_alias]
+        key = f'newsletter-quota:{owner}:{period}:{int(now // period)}'
+        cache.add(key, 0, timeout=period + 1)
+        used = cache.incr(key, count)
+        over = min(max(used - limit, 0), count)
+        if over:
+            cache.decr(key, over)
+        return count - over
+
+    def take(self, owner, count, per_hour=None, per_day=None):
+        """
+        Takes up to ``count`` sends from the owner's quotas. Returns how many
+        were granted and, when that is fewer than asked, the time the
+        exhausted quota starts over.
+        """
+        if (per_hour or per_day) and not is_shared(self.cache_alias):
+            raise ImproperlyConfigured(f"Send quotas are counted in the '{self.cache_alias}' cache, which is not "
+                                       f"shared between processes; set CACHE_ENABLED or NEWSLETTER_RATE_CACHE")
+        now = time.time()
+        granted = count
+        resume_at = None
+        for limit, period in ((per_hour, HOUR), (per_day, DAY)):
+            if not limit or not granted:
+                continue
+            allowed = self._take(owner, granted, limit, period, now)
+            if allowed < granted:
+                resume_at = max(resume_at or 0, (now // period + 1) * period)
+                if period == DAY and per_hour:
+                    caches[self.cache_alias].decr(f'newsletter-quota:{owner}:{HOUR}:{int(now // HOUR)}',
+                                                  granted - allowed)
+            granted = allowed
+        return granted, resume_at
+
+
+send_quota = SendQuota()
@@ -0,0 +1,230 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, make_msgid
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.mail.message import DNS_NAME, forbid_multi_line_headers
+
+from config.settings import EMAIL_HOST_USER, NEWSLETTER_RENDER_CACHE_SIZE
+
+PLACEHOLDER = re.compile(r'{{\s*(full_name|email)\s*}}')
+
+
+def _normalize_newlines(text, linesep):
+    if '\r' in text:
+        text = text.replace('\r\n', '\n')
+    if linesep != '\n' and '\n' in text:
+        text = text.replace('\n', linesep)
+    return text
+
+
+def content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class CompiledTemplate:
+    """
+    Text with ``{{ full_name }}`` and ``{{ email }}`` placeholders, split once
+    into literal chunks and the recipient fields to put between them.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        parts = PLACEHOLDER.split(text)
+        self.literals = parts[0::2]
+        self.fields = parts[1::2]
+        self._encoded = {}
+
+    @property
+    def is_static(self):
+        return not self.fields
+
+    def render(self, recipient):
+        if not self.fields:
+            return self.text
+        chunks = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            chunks.append(getattr(recipient, field) or '')
+            chunks.append(literal)
+        return ''.join(chunks)
+
+    def render_chunks(self, recipient, linesep, encoding):
+        """Encoded chunks of the render with ``linesep`` line endings; literals are encoded only once."""
+        literals = self._encoded.get((linesep, encoding))
+        if literals is None:
+            literals = self._encoded[linesep, encoding] = [
+                _normalize_newlines(literal, linesep).encode(encoding) for literal in self.literals
+            ]
+        chunks = [literals[0]]
+        for field, literal in zip(self.fields, literals[1:]):
+            chunks.append(_normalize_newlines(getattr(recipient, field) or '', linesep).encode(encoding))
+            chunks.append(literal)
+        return chunks
+
+
+def _split_flattened(mime, linesep):
+    flattened = mime.as_bytes(linesep=linesep)
+    separator = linesep.encode() * 2
+    head, _, body = flattened.partition(separator)
+    return head + linesep.encode(), body
+
+
+class RenderedMessage:
+    """
+    A newsletter message compiled for sending.
+
+    Headers that are the same for every recipient are flattened to bytes
+    once, and so is the body when it has no placeholders. ``for_recipient()``
+    then only adds To, Date and Message-ID, plus the Subject and the encoded
+    body when those are personalized. Bodies that need quoted-printable
+    (lines over 998 bytes) are fully rendered for every recipient instead.
+    """
+
+    def __init__(self, subject, body, from_email=EMAIL_HOST_USER):
+        template = EmailMessage(subject, body, from_email=from_email)
+        self.subject = CompiledTemplate(template.subject)
+        self.body = CompiledTemplate(template.body)
+        self.from_email = template.from_email
+        self.encoding = template.encoding or settings.DEFAULT_CHARSET
+
+        mime = template.message()
+        del mime['Date']
+        del mime['Message-ID']
+        if not self.subject.is_static:
+            del mime['Subject']
+        self.charset = mime.get_charset()
+        self.full_render = not self.body.is_static and mime['Content-Transfer-Encoding'] not in ('7bit', '8bit')
+        if not self.body.is_static:
+            mime.replace_header('Content-Transfer-Encoding', '8bit')
+
+        self._head = {}
+        self._body = {}
+        for linesep in ('\r\n', '\n'):
+            self._head[linesep], self._body[linesep] = _split_flattened(mime, linesep)
+
+    def head_bytes(self, linesep):
+        if linesep not in self._head:
+            self._head[linesep] = self._head['\n'].replace(b'\n', linesep.encode())
+        return self._head[linesep]
+
+    def body_bytes(self, linesep):
+        if linesep not in self._body:
+            self._body[linesep] = self._body['\n'].replace(b'\n', linesep.encode())
+        return self._body[linesep]
+
+    def for_recipient(self, recipient):
+        if self.full_render:
+            return EmailMessage(
+                self.subject.render(recipient),
+                self.body.render(recipient),
+                from_email=self.from_email,
+                to=[recipient.email],
+            )
+        return PreparedEmail(self, recipient)
+
+
+class PrerenderedMIME:
+    """The minimal part of email.message.Message the mail backends rely on."""
+
+    def __init__(self, rendered, headers, recipient):
+        self.rendered = rendered
+        self.headers = headers
+        self.recipient = recipient
+
+    def get_charset(self):
+        return self.rendered.charset
+
+    def as_bytes(self, unixfrom=False, linesep='\n'):
+        rendered = self.rendered
+        head = ''.join(f'{name}: {value}{linesep}' for name, value in self.headers)
+        chunks = [head.encode(rendered.encoding), rendered.head_bytes(linesep), linesep.encode()]
+        if rendered.body.is_static:
+            chunks.append(rendered.body_bytes(linesep))
+        else:
+            chunks.extend(rendered.body.render_chunks(self.recipient, linesep, rendered.encoding))
+        return b''.join(chunks)
+
+    def as_string(self, unixfrom=False, linesep='\n'):
+        return self.as_bytes(unixfrom, linesep).decode(self.rendered.encoding, errors='replace')
+
+
+class PreparedEmail(EmailMessage):
+    """
+    EmailMessage to a single recipient built on top of a RenderedMessage.
+    The personalized ``body`` is only rendered as text when something asks
+    for it; sending encodes it straight from the compiled template.
+    """
+
+    def __init__(self, rendered, recipient):
+        self.rendered = rendered
+        self.recipient = recipient
+        super().__init__(
+            rendered.subject.render(recipient),
+            from_email=rendered.from_email,
+            to=[recipient.email],
+        )
+
+    @property
+    def body(self):
+        return self.rendered.body.render(self.recipient)
+
+    @body.setter
+    def body(self, value):
+        pass
+
+    def message(self):
+        encoding = self.rendered.encoding
+        headers = [
+            forbid_multi_line_headers('To', self.to[0], encoding),
+            ('Date', formatdate(localtime=settings.EMAIL_USE_LOCALTIME)),
+            ('Message-ID', make_msgid(domain=DNS_NAME)),
+        ]
+        if not self.rendered.subject.is_static:
+            headers.append(forbid_multi_line_headers('Subject', self.subject, encoding))
+        return PrerenderedMIME(self.rendered, headers, self.recipient)
+
+
+class RenderCache:
+    """Thread-safe LRU of RenderedMessage keyed by message id and version."""
+
+    def __init__(self, maxsize=NEWSLETTER_RENDER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, message_id, subject, body, from_email=EMAIL_HOST_USER):
+        key = (message_id, content_hash(subject, body, from_email))
+        with self._lock:
+            rendered = self._items.get(key)
+            if rendered is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return rendered
+            self.misses += 1
+
+        rendered = RenderedMessage(subject, body, from_email)
+        with self._lock:
+            self._items[key] = rendered
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return rendered
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+render_cache = RenderCache()
+
+
+def render_message(message):
+    return render_cache.get(message.id, message.topic, message.content)
@@ -1,68 +1,255 @@
-from django.utils import timezone
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
 from apscheduler.schedulers.background import BackgroundScheduler
 from django.apps import apps
-from django_apscheduler.jobstores import DjangoJobStore
-from django.core.mail import send_mail
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+from django_apscheduler.util import close_old_connections
 
-from config.settings import EMAIL_HOST_USER
+from config.settings import NEWSLETTER_SWEEP_INTERVAL, NEWSLETTER_DISPATCH_THREADS, NEWSLETTER_MISFIRE_GRACE, \
+    NEWSLETTER_SCHEDULER_LEASE, NEWSLETTER_STATS_INTERVAL
+from newsletter.cancellation import RunCancelled
+from newsletter.delivery import deliver_newsletter, retry_failed_attempts, set_run_status, DuplicateRun
+from newsletter.dispatch import SEND, RETRY, RESUME, enqueue, claim_tasks, touch_task, finish_task
+from newsletter.metrics import registry
+from newsletter.ratelimit import QuotaExceeded
+from newsletter.sharding import plan_shards, work_shards, worker_name
+from newsletter.stats import reconcile_stats
 import logging
 
 logger = logging.getLogger(__name__)
 
+LEASE_NAME = 'newsletter-scheduler'
 
-def send_newsletter(newsletter_id):
+dispatch_pool = ThreadPoolExecutor(max_workers=NEWSLETTER_DISPATCH_THREADS, thread_name_prefix='newsletter-dispatch')
+running = set()
+running_lock = threading.Lock()
+
+
+@close_old_connections
+def send_newsletter(newsletter_id, progress=None):
+    """
+    Sends the newsletter's current run; returns how many recipients this
+    process went through. ``progress`` is called after every batch.
+    """
     Newsletter = apps.get_model('newsletter', 'Newsletter')
-    Attempt = apps.get_model('newsletter', 'Attempt')
+    Shard = apps.get_model('newsletter', 'Shard')
     try:
         newsletter = Newsletter.objects.get(id=newsletter_id)
-        logger.info(f"Sending newsletter {newsletter_id} to clients")
-        for client in newsletter.clients.all():
-            logger.info(f"Sending email to {client.email}")
-            try:
-                send_mail(
-                    newsletter.message.topic,
-                    newsletter.message.content,
-                    from_email=EMAIL_HOST_USER,
-                    recipient_list=[client.email],
-                )
-                Attempt.objects.create(
-                    newsletter=newsletter,
-                    client=client,
-                    last_attempt_time=timezone.now(),
-                    last_attempt_status='S',
-                    server_response=200
-                )
-                logger.info(f"Attempt successful for {client.email}")
-            except Exception as e:
-                Attempt.objects.create(
-                    newsletter=newsletter,
-                    client=client,
-                    last_attempt_time=timezone.now(),
-                    last_attempt_status='F',
-                    server_response=500
-                )
-                logger.error(f"Attempt failed for {client.email}: {e}")
-        newsletter.status = 'S'
-        newsletter.save()
+        if plan_shards(newsletter):
+            worker = worker_name()
+            work_shards(worker, newsletter.id, progress)
+            return Shard.objects.filter(newsletter=newsletter, run=newsletter.run, claimed_by=worker).aggregate(
+                processed=Sum('processed')
+            )['processed'] or 0
+        processed = deliver_newsletter(newsletter, progress=progress)
+        set_run_status(newsletter, 'S')
+        return processed
 
     except Newsletter.DoesNotExist:
         logger.error(f"Newsletter {newsletter_id} does not exist")
         pass
 
+    except DuplicateRun as e:
+        logger.warning(f"Skipping newsletter {newsletter_id}: {e}")
+
+    except RunCancelled as e:
+        set_run_status(newsletter, 'C')
+        logger.info(str(e))
+
+    except QuotaExceeded as e:
+        enqueue(newsletter.id, RESUME, e.resume_at)
+        logger.info(f"{e}, resuming at {e.resume_at}")
+
     except Exception as e:
-        newsletter.status = 'F'
-        newsletter.save()
+        set_run_status(newsletter, 'F')
         logger.error(f"Error sending newsletter {newsletter_id}: {e}")
+    return 0
 
 
-def start_scheduler():
-    from apscheduler.schedulers.background import BackgroundScheduler
-    from django_apscheduler.jobstores import DjangoJobStore
+@close_old_connections
+def retry_newsletter(newsletter_id):
+    Newsletter = apps.get_model('newsletter', 'Newsletter')
+    try:
+        newsletter = Newsletter.objects.get(id=newsletter_id)
+        if newsletter.finished:
+            logger.info(f"Newsletter {newsletter_id} is finished, dropping its retries")
+            return 0
+        return retry_failed_attempts(newsletter)
+
+    except Newsletter.DoesNotExist:
+        logger.error(f"Newsletter {newsletter_id} does not exist")
+
+    except Exception as e:
+        logger.error(f"Error retrying newsletter {newsletter_id}: {e}")
+    return 0
+
+
+def record_task(task):
+    """Puts the timings of a finished dispatch task into the metrics registry."""
+    kind = task.get_kind_display().lower()
+    registry.inc('newsletter_dispatch_tasks_total', 'Finished dispatch tasks', kind=kind,
+                 state=task.get_state_display().lower())
+    registry.observe('newsletter_dispatch_lag_seconds', 'Delay between the scheduled and the actual start',
+                     (task.started_at - task.due_at).total_seconds(), kind=kind)
+    registry.observe('newsletter_dispatch_poll_delay_seconds', 'Delay between the scheduled time and the claim',
+                     (task.locked_at - task.due_at).total_seconds(), kind=kind)
+    registry.observe('newsletter_dispatch_queue_wait_seconds', 'Time a claimed task waited for a dispatch thread',
+                     (task.started_at - task.locked_at).total_seconds(), kind=kind)
+    registry.observe('newsletter_dispatch_run_seconds', 'Time spent running the task',
+                     (task.finished_at - task.started_at).total_seconds(), kind=kind)
+    registry.inc('newsletter_dispatch_recipients_total', 'Recipients processed by dispatch tasks',
+                 task.recipients, kind=kind)
+    if task.state == 'M':
+        registry.inc('newsletter_dispatch_misfires_total', 'Sends skipped for starting too late')
 
+
+@close_old_connections
+def run_task(task):
+    """
+    Runs a claimed dispatch task. A send task books its occurrence and
+    queues the following one in one transaction, then starts a new run and
+    sends unless the occurrence was missed by more than
+    NEWSLETTER_MISFIRE_GRACE or the newsletter is finished. A send taken
+    over from a worker that stopped reporting is not booked again: it
+    resumes the run that worker started, regardless of the delay. A resume
+    task carries on with a run that was stopped by its owner's send quota.
+    """
+    Newsletter = apps.get_model('newsletter', 'Newsletter')
+    DispatchTask = apps.get_model('newsletter', 'DispatchTask')
+    task.started_at = timezone.now()
+    state = 'D'
+    try:
+        if task.kind == RETRY:
+            task.recipients = retry_newsletter(task.newsletter_id)
+        elif task.kind == RESUME:
+            task.recipients = send_newsletter(task.newsletter_id, progress=lambda count: touch_task(task))
+        else:
+            newsletter = Newsletter.objects.only(
+                'id', 'last_run_at', 'run_started_at', 'status', *Newsletter.SCHEDULE_FIELDS
+            ).get(id=task.newsletter_id)
+            booked_at = newsletter.last_run_at
+            # Booked by an earlier attempt of this task, whose worker died
+            booked = task.attempts > 1 and booked_at is not None and booked_at >= task.due_at
+            newsletter.last_run_at = max(booked_at, task.due_at) if booked else task.due_at
+            following = newsletter.compute_next_run(task.started_at)
+            misfired = task.due_at < task.started_at - timedelta(seconds=NEWSLETTER_MISFIRE_GRACE)
+
+            if booked:
+                if following is not None and not DispatchTask.objects.filter(
+                        newsletter_id=newsletter.id, kind=SEND, state='W').exists():
+                    enqueue(newsletter.id, SEND, following)
+                started = (booked_at == task.due_at and newsletter.status == 'P'
+                           and newsletter.run_started_at is not None and newsletter.run_started_at >= task.due_at)
+            else:
+                with transaction.atomic():
+                    Newsletter.objects.filter(id=newsletter.id).update(last_run_at=task.due_at)
+                    if following is not None:
+                        enqueue(newsletter.id, SEND, following)
+                    # Every occurrence is a run of its own; whatever an
+                    # earlier run left unsent is not carried over
+                    started = not misfired and bool(Newsletter.objects.filter(id=newsletter.id, finished=False).update(
+                        run=F('run') + 1, run_started_at=task.started_at, status='P'
+                    ))
+
+            if started:
+                if booked:
+                    logger.warning(f"Resuming send of newsletter {newsletter.id} due at {task.due_at}, "
+                                   f"attempt {task.attempts}")
+                task.recipients = send_newsletter(newsletter.id, progress=lambda count: touch_task(task))
+            elif booked:
+                logger.info(f"Send of newsletter {newsletter.id} due at {task.due_at} has no run left to resume")
+            elif misfired:
+                logger.warning(f"Skipped send of newsletter {newsletter.id} due at {task.due_at}, "
+                               f"claimed {task.locked_at - task.due_at} late, "
+                               f"waited {task.started_at - task.locked_at} for a thread")
+                state = 'M'
+            else:
+                logger.info(f"Newsletter {newsletter.id} is finished, dropping its send")
+
+    except Exception as e:
+        state = 'F'
+        logger.error(f"Error running dispatch task {task.id}: {e}")
+
+    finally:
+        try:
+            finish_task(task, state)
+            record_task(task)
+        finally:
+            with running_lock:
+                running.discard(task.pk)
+
+
+@close_old_connections
+def sweep_due_tasks():
+    """Claims as many due dispatch tasks as there are idle dispatch threads."""
+    with running_lock:
+        idle = NEWSLETTER_DISPATCH_THREADS - len(running)
+    tasks = claim_tasks(worker_name(), idle)
+    with running_lock:
+        running.update(task.pk for task in tasks)
+    for task in tasks:
+        dispatch_pool.submit(run_task, task)
+    if tasks:
+        logger.info(f"Dispatched {len(tasks)} tasks")
+
+
+@close_old_connections
+def refresh_stats():
+    reconcile_stats()
+
+
+def acquire_lease(holder, name=LEASE_NAME, ttl=NEWSLETTER_SCHEDULER_LEASE):
+    """
+    Takes the scheduler lease if it is free or expired, or renews it if
+    ``holder`` already has it. Returns True while ``holder`` is the leader.
+    """
+    SchedulerLease = apps.get_model('newsletter', 'SchedulerLease')
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl)
+    if SchedulerLease.objects.filter(Q(holder=holder) | Q(expires_at__lt=now), name=name).update(
+            holder=holder, expires_at=expires_at):
+        return True
+    try:
+        with transaction.atomic():
+            SchedulerLease.objects.create(name=name, holder=holder, expires_at=expires_at)
+    except IntegrityError:
+        return False
+    return True
+
+
+def release_lease(holder, name=LEASE_NAME):
+    SchedulerLease = apps.get_model('newsletter', 'SchedulerLease')
+    SchedulerLease.objects.filter(name=name, holder=holder).delete()
+
+
+def start_scheduler():
+    """
+    Starts the scheduler with the jobs that poll the dispatch queue and
+    recount the home page statistics. Only the run_scheduler command calls
+    this, once it holds the scheduler lease.
+    """
     scheduler = BackgroundScheduler()
-    scheduler.add_jobstore(DjangoJobStore(), "default")
+    scheduler.add_job(
+        sweep_due_tasks,
+        trigger='interval',
+        seconds=NEWSLETTER_SWEEP_INTERVAL,
+        id='sweep-due-tasks',
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+    scheduler.add_job(
+        refresh_stats,
+        trigger='interval',
+        seconds=NEWSLETTER_STATS_INTERVAL,
+        id='reconcile-stats',
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
     scheduler.start()
     return scheduler
-
-
-scheduler = start_scheduler()
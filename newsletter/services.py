@@ -1,27 +1,159 @@
 import logging
+import time
 
-from django.core.cache import cache
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.connection import ConnectionProxy
+from django.utils.safestring import mark_safe
 
-from config.settings import CACHE_TTL, CACHE_ENABLED
+from config.settings import CACHE_TTL, CACHE_ENABLED, CACHE_SERVICES, CACHE_LIST_VARIANTS
+from newsletter.metrics import registry
 from newsletter.models import Newsletter
 
 logger = logging.getLogger(__name__)
 
+cache = ConnectionProxy(caches, CACHE_SERVICES)
+
+# Keys under 'newsletters_list:' and 'main_page:' carry the list version and
+# are never rewritten, see CACHE_WRITE_ONCE_KEYS; the version itself is not
+LIST_KEY = 'newsletters_list'
+LIST_VERSION_KEY = 'newsletters_list_version'
+PAGE_KEY = 'main_page'
+
+# The only permission that changes how the list renders
+VIEW_ANY_PERMISSION = 'newsletter.can_view_any_newsletter'
+
+# Newsletter fields the main page shows; saves that touch none of them
+# (run bookkeeping by the scheduler) leave the cached list alone
+LIST_FIELDS = ('initial', 'end_date', 'finished', 'user', 'message')
+
+
+def list_version():
+    version = cache.get(LIST_VERSION_KEY)
+    if version is None:
+        # Start above any version that may have been evicted, so entries
+        # written under it are never read again
+        cache.add(LIST_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(LIST_VERSION_KEY)
+    return version
+
+
+def invalidate_newsletter_list():
+    """Moves every process to a new version of the list; entries of the old one are left to expire."""
+    if not CACHE_ENABLED:
+        return
+    try:
+        cache.incr(LIST_VERSION_KEY)
+    except ValueError:
+        list_version()
+    logger.debug("Newsletter list cache invalidated")
+
+
+def build_newsletter_list():
+    """
+    Rows the main page renders: the newsletter, its message and the emails
+    of its clients, as plain values in two queries.
+    """
+    started = time.monotonic()
+    rows = list(Newsletter.objects.order_by('pk').values(
+        'id', 'initial', 'end_date', 'finished', 'user_id', 'message__topic', 'message__content',
+    ))
+    emails = {}
+    for newsletter_id, email in Newsletter.clients.through.objects.order_by('pk').values_list(
+            'newsletter_id', 'client__email'):
+        emails.setdefault(newsletter_id, []).append(email)
+    for row in rows:
+        row['topic'] = row.pop('message__topic')
+        row['content'] = row.pop('message__content')
+        row['client_emails'] = emails.get(row['id'], [])
+    registry.observe('newsletter_list_cache_rebuild_seconds', 'Time spent building the newsletter list',
+                     time.monotonic() - started)
+    return rows
+
 
 def get_newsletters_from_cache():
     if not CACHE_ENABLED:
         logger.debug("Cache is not enabled.")
-        return Newsletter.objects.all()
+        return build_newsletter_list()
 
-    key = 'newsletters_list'
+    key = f'{LIST_KEY}:{list_version()}'
     newsletters = cache.get(key)
 
     if newsletters is not None:
         logger.debug("Cache hit for key: %s", key)
+        registry.inc('newsletter_list_cache_total', 'Newsletter list cache lookups', result='hit')
         return newsletters
 
     logger.debug("Cache miss for key: %s", key)
-    newsletters = Newsletter.objects.all()
+    registry.inc('newsletter_list_cache_total', 'Newsletter list cache lookups', result='miss')
+    newsletters = build_newsletter_list()
     cache.set(key, newsletters, timeout=CACHE_TTL)
     logger.debug("Cache set for key: %s", key)
-    return newsletters
\ No newline at end of file
+    return newsletters
+
+
+def list_variant(user, rows):
+    """
+    The rendering of the list a viewer gets: their id if they own one of the
+    listed newsletters (viewers owning none see the same cards) and whether
+    they may view any newsletter.
+    """
+    if not user.is_authenticated:
+        return None, False
+    owner_id = user.pk if any(row['user_id'] == user.pk for row in rows) else None
+    return owner_id, user.has_perm(VIEW_ANY_PERMISSION)
+
+
+def render_newsletter_cards(owner_id, can_view_any, rows):
+    return mark_safe(render_to_string('newsletter/includes/newsletter_cards.html', {
+        'newsletters': rows, 'owner_id': owner_id, 'can_view_any': can_view_any,
+    }))
+
+
+def get_newsletter_cards(user):
+    """
+    Cards of the main page for ``user``, cached per variant of the current
+    list version. Once CACHE_LIST_VARIANTS variants of a version are cached
+    further ones are rendered on every request.
+    """
+    rows = get_newsletters_from_cache()
+    owner_id, can_view_any = list_variant(user, rows)
+    if not CACHE_ENABLED:
+        return render_newsletter_cards(owner_id, can_view_any, rows)
+
+    version = list_version()
+    key = f'{LIST_KEY}:{version}:cards:{owner_id or 0}:{int(can_view_any)}'
+    cards = cache.get(key)
+    if cards is not None:
+        registry.inc('newsletter_list_variant_total', 'Main page card variant lookups', result='hit')
+        return mark_safe(cards)
+
+    registry.inc('newsletter_list_variant_total', 'Main page card variant lookups', result='miss')
+    cards = render_newsletter_cards(owner_id, can_view_any, rows)
+    variants_key = f'{LIST_KEY}:{version}:variants'
+    cache.add(variants_key, 0, timeout=CACHE_TTL)
+    if cache.incr(variants_key) <= CACHE_LIST_VARIANTS:
+        cache.set(key, str(cards), timeout=CACHE_TTL)
+    else:
+        registry.inc('newsletter_list_variant_total', 'Main page card variant lookups', result='uncached')
+    return cards
+
+
+def get_anonymous_page(render):
+    """
+    The main page as anonymous visitors see it, rendered by ``render()``
+    once per list version and then served from the cache without queries.
+    """
+    if not CACHE_ENABLED:
+        return render()
+
+    key = f'{PAGE_KEY}:{list_version()}'
+    content = cache.get(key)
+    if content is not None:
+        registry.inc('newsletter_main_page_cache_total', 'Anonymous main page cache lookups', result='hit')
+        return content
+
+    registry.inc('newsletter_main_page_cache_total', 'Anonymous main page cache lookups', result='miss')
+    content = render()
+    cache.set(key, content, timeout=CACHE_TTL)
+    return content
@@ -0,0 +1,147 @@
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from config.settings import NEWSLETTER_SHARD_SIZE, NEWSLETTER_SHARD_TIMEOUT
+from newsletter.cancellation import RunCancelled
+from newsletter.delivery import deliver_newsletter, DuplicateRun
+from newsletter.ratelimit import QuotaExceeded
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def plan_shards(newsletter, shard_size=NEWSLETTER_SHARD_SIZE):
+    """
+    Splits the newsletter's current run into client id ranges of
+    ``shard_size`` recipients. Returns False when the run is small enough to
+    be sent in one go, True when it is (or already was) sharded.
+    """
+    Shard = apps.get_model('newsletter', 'Shard')
+    if Shard.objects.filter(newsletter=newsletter, run=newsletter.run).exists():
+        return True
+    if not shard_size or newsletter.clients.count() <= shard_size:
+        return False
+
+    shards = []
+    ids = newsletter.clients.order_by('id').values_list('id', flat=True).iterator(chunk_size=shard_size)
+    first_id = last_id = None
+    size = 0
+    for client_id in ids:
+        if first_id is None:
+            first_id = client_id
+        last_id = client_id
+        size += 1
+        if size == shard_size:
+            shards.append(Shard(newsletter=newsletter, run=newsletter.run, first_client_id=first_id,
+                                last_client_id=last_id, size=size))
+            first_id, size = None, 0
+    if size:
+        shards.append(Shard(newsletter=newsletter, run=newsletter.run, first_client_id=first_id,
+                            last_client_id=last_id, size=size))
+
+    Shard.objects.bulk_create(shards, ignore_conflicts=True)
+    logger.info(f"Split run {newsletter.run} of newsletter {newsletter.id} into {len(shards)} shards")
+    return True
+
+
+def claim_shard(worker, newsletter_id=None):
+    """
+    Takes the next waiting shard, or a running one whose worker stopped
+    reporting, with SELECT ... FOR UPDATE SKIP LOCKED so concurrent workers
+    never get the same shard. Shards of runs that were superseded by a
+    later occurrence are left alone, and so are shards of owners whose
+    send quota is used up until it starts over.
+    """
+    Shard = apps.get_model('newsletter', 'Shard')
+    now = timezone.now()
+    claimable = Shard.objects.filter(
+        Q(state='W') | Q(state='R', heartbeat_at__lt=now - timedelta(seconds=NEWSLETTER_SHARD_TIMEOUT)),
+        Q(not_before__isnull=True) | Q(not_before__lte=now),
+        run=F('newsletter__run'),
+    )
+    if newsletter_id is not None:
+        claimable = claimable.filter(newsletter_id=newsletter_id)
+
+    with transaction.atomic():
+        shard = claimable.select_for_update(skip_locked=True, of=('self',)).order_by('id').first()
+        if shard is None:
+            return None
+        shard.state = 'R'
+        shard.claimed_by = worker
+        shard.heartbeat_at = now
+        shard.save(update_fields=['state', 'claimed_by', 'heartbeat_at'])
+    return shard
+
+
+def process_shard(shard, worker, on_progress=None):
+    Shard = apps.get_model('newsletter', 'Shard')
+    newsletter = shard.newsletter
+    logger.info(f"Worker {worker} took shard {shard}")
+
+    def progress(count):
+        Shard.objects.filter(pk=shard.pk).update(processed=F('processed') + count, heartbeat_at=timezone.now())
+        if on_progress is not None:
+            on_progress(count)
+
+    try:
+        deliver_newsletter(newsletter, shard.first_client_id, shard.last_client_id, progress=progress)
+        shard.state = 'S'
+    except DuplicateRun as e:
+        logger.warning(f"Leaving shard {shard} to another worker: {e}")
+        return
+    except RunCancelled as e:
+        logger.info(f"Stopped shard {shard}: {e}")
+        shard.state = 'C'
+    except QuotaExceeded as e:
+        shard.state = 'W'
+        shard.not_before = e.resume_at
+        shard.save(update_fields=['state', 'not_before'])
+        # The owner's other shards would only run into the same quota
+        Shard.objects.filter(state='W', newsletter__user_id=newsletter.user_id).update(not_before=e.resume_at)
+        raise
+    except Exception as e:
+        logger.error(f"Error sending shard {shard}: {e}")
+        shard.state = 'F'
+    shard.heartbeat_at = timezone.now()
+    shard.save(update_fields=['state', 'heartbeat_at'])
+    finish_run(newsletter.id, shard.run)
+
+
+def finish_run(newsletter_id, run):
+    """Marks the newsletter 'S', 'F' or 'C' once every shard of its run is done."""
+    Newsletter = apps.get_model('newsletter', 'Newsletter')
+    Shard = apps.get_model('newsletter', 'Shard')
+    with transaction.atomic():
+        newsletter = Newsletter.objects.select_for_update().get(id=newsletter_id)
+        shards = Shard.objects.filter(newsletter_id=newsletter_id, run=run)
+        if newsletter.run != run or shards.filter(state__in=['W', 'R']).exists():
+            return
+        if shards.filter(state='C').exists():
+            newsletter.status = 'C'
+        elif shards.filter(state='F').exists():
+            newsletter.status = 'F'
+        else:
+            newsletter.status = 'S'
+        newsletter.save(update_fields=['status'])
+    logger.info(f"Run {run} of newsletter {newsletter_id} finished with status {newsletter.status}")
+
+
+def work_shards(worker=None, newsletter_id=None, progress=None):
+    """Processes claimable shards until there are none left; returns how many were taken."""
+    worker = worker or worker_name()
+    taken = 0
+    while (shard := claim_shard(worker, newsletter_id)) is not None:
+        process_shard(shard, worker, progress)
+        taken += 1
+    return taken
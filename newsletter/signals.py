@@ -0,0 +1,64 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from blog.models import Post
+from newsletter.models import Newsletter, Message, Client
+from newsletter.services import invalidate_newsletter_list, LIST_FIELDS
+from newsletter.stats import NEWSLETTERS, ACTIVE_NEWSLETTERS, CLIENTS, bump, is_active
+
+ACTIVITY_FIELDS = ('initial', 'end_date', 'finished')
+
+
+def activity(values):
+    """Whether the newsletter values are active, or None if some were not loaded."""
+    if not all(name in values for name in ACTIVITY_FIELDS):
+        return None
+    return is_active(values)
+
+
+@receiver(post_save, sender=Newsletter)
+def newsletter_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        bump(**{NEWSLETTERS: 1, ACTIVE_NEWSLETTERS: int(bool(activity(instance.schedule())))})
+    else:
+        # Newsletter.save() updates _saved_schedule only after the signal
+        was_active = activity(getattr(instance, '_saved_schedule', {}))
+        now_active = activity(instance.schedule())
+        if was_active is not None and now_active is not None:
+            bump(**{ACTIVE_NEWSLETTERS: int(now_active) - int(was_active)})
+    if update_fields is not None and not set(update_fields) & set(LIST_FIELDS):
+        return
+    invalidate_newsletter_list()
+
+
+@receiver(post_delete, sender=Newsletter)
+def newsletter_deleted(sender, instance, **kwargs):
+    bump(**{NEWSLETTERS: -1, ACTIVE_NEWSLETTERS: -int(bool(activity(instance.schedule())))})
+    invalidate_newsletter_list()
+
+
+@receiver(post_save, sender=Client)
+def client_saved(sender, instance, created, **kwargs):
+    if created:
+        bump(**{CLIENTS: 1})
+    invalidate_newsletter_list()
+
+
+@receiver(post_delete, sender=Client)
+def client_deleted(sender, instance, **kwargs):
+    bump(**{CLIENTS: -1})
+    invalidate_newsletter_list()
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+# The anonymous main page links to random posts
+@receiver(post_delete, sender=Post)
+def list_row_changed(sender, **kwargs):
+    invalidate_newsletter_list()
+
+
+@receiver(m2m_changed, sender=Newsletter.clients.through)
+def newsletter_clients_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate_newsletter_list()
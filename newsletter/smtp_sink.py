@@ -0,0 +1,99 @@
+import random
+import socketserver
+import threading
+import time
+
+from django.core.mail.backends.smtp import EmailBackend
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail from smtplib and throw it away."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        sink = self.server.sink
+        self.reply('220 sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.reply('250-sink')
+                self.reply('250 8BITMIME')
+            elif command in (b'HELO', b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self.reply('250 OK')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                if sink.latency:
+                    time.sleep(sink.latency)
+                if sink.failure_rate and random.random() < sink.failure_rate:
+                    sink.count(failed=True)
+                    self.reply('451 Requested action aborted: sink failure')
+                else:
+                    sink.count(failed=False)
+                    self.reply('250 OK: queued')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    """
+    Local SMTP server for benchmarks. Every message is answered after
+    ``latency`` seconds, and with a 451 instead of 250 with probability
+    ``failure_rate``.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.accepted = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self.server = SinkServer((host, port), SinkHandler)
+        self.server.sink = self
+        self.host, self.port = self.server.server_address
+        self._thread = threading.Thread(target=self.server.serve_forever, name='smtp-sink', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, failed):
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.accepted += 1
+
+
+class TimedEmailBackend(EmailBackend):
+    """SMTP backend that records how long every send_messages() call took."""
+
+    latencies = []
+    _lock = threading.Lock()
+
+    def send_messages(self, email_messages):
+        started = time.perf_counter()
+        try:
+            return super().send_messages(email_messages)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.latencies.append(elapsed)
@@ -0,0 +1,74 @@
+import logging
+
+from django.apps import apps
+from django.db.models import F
+from django.utils import timezone
+
+from newsletter.metrics import registry
+from newsletter.services import invalidate_newsletter_list
+
+logger = logging.getLogger(__name__)
+
+NEWSLETTERS = 'newsletters'
+ACTIVE_NEWSLETTERS = 'active_newsletters'
+CLIENTS = 'clients'
+STATS = (NEWSLETTERS, ACTIVE_NEWSLETTERS, CLIENTS)
+
+
+def is_active(values, now=None):
+    """Whether a newsletter with these ``initial``, ``end_date`` and ``finished`` values is active."""
+    now = now or timezone.now()
+    end_date = values.get('end_date')
+    return end_date is not None and values['initial'] <= now <= end_date and not values['finished']
+
+
+def count_stats(now=None):
+    Newsletter = apps.get_model('newsletter', 'Newsletter')
+    Client = apps.get_model('newsletter', 'Client')
+    now = now or timezone.now()
+    return {
+        NEWSLETTERS: Newsletter.objects.count(),
+        ACTIVE_NEWSLETTERS: Newsletter.objects.filter(initial__lte=now, end_date__gte=now, finished=False).count(),
+        CLIENTS: Client.objects.count(),
+    }
+
+
+def bump(**deltas):
+    """Adds the deltas to the stored statistics; they are recounted if any is not stored yet."""
+    Statistic = apps.get_model('newsletter', 'Statistic')
+    for name, delta in deltas.items():
+        if delta and not Statistic.objects.filter(name=name).update(value=F('value') + delta):
+            reconcile_stats()
+            return
+
+
+def reconcile_stats():
+    """
+    Recounts the statistics. The active count changes with time alone, as
+    newsletters pass their initial or end date, so the scheduler runs this
+    every NEWSLETTER_STATS_INTERVAL seconds; it also repairs any drift left
+    by bulk updates that send no signals. Returns the corrected values.
+    """
+    Statistic = apps.get_model('newsletter', 'Statistic')
+    counts = count_stats()
+    stored = dict(Statistic.objects.values_list('name', 'value'))
+    changed = {name: value for name, value in counts.items() if stored.get(name) != value}
+    for name, value in changed.items():
+        Statistic.objects.update_or_create(name=name, defaults={'value': value})
+        if name in stored:
+            registry.inc('newsletter_stats_drift_total', 'Corrections made by statistics reconciliation',
+                         abs(value - stored[name]), stat=name)
+    if changed:
+        logger.info(f"Statistics reconciled: {changed}")
+        # The anonymous main page is cached with the statistics in it
+        invalidate_newsletter_list()
+    return counts
+
+
+def get_stats():
+    """The statistics of the home page, read in one query."""
+    Statistic = apps.get_model('newsletter', 'Statistic')
+    stats = dict(Statistic.objects.filter(name__in=STATS).values_list('name', 'value'))
+    if len(stats) < len(STATS):
+        return reconcile_stats()
+    return stats
@@ -1,3 +1,604 @@
-# from django.test import TestCase
+import smtplib
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+from django.core.cache import caches
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from newsletter.cache_backends import TwoLevelCache, _stores
+from newsletter.cancellation import RunCancelled
+from newsletter.delivery import AttemptBuffer, DuplicateRun, iter_recipients, last_claimed_client, set_run_status
+from newsletter.dispatch import SEND, pick_fair
+from newsletter.fairshare import FairShare
+from newsletter.models import Newsletter, Client, Message, Attempt, DispatchTask, Shard
+from newsletter.ratelimit import RateLimiter, SendQuota, QuotaExceeded, SECOND, HOUR, DAY
+from newsletter.scheduler import run_task
+from newsletter.sharding import plan_shards, claim_shard, process_shard, finish_run
+from users.models import User
+
+BERLIN = ZoneInfo('Europe/Berlin')
+
+# Five hours and 100 seconds into a day
+NOW = 19_000 * DAY + 5 * HOUR + 100
+
+TWO_LEVEL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+}
+
+
+@override_settings(CACHES=TWO_LEVEL_CACHES)
+class TwoLevelCacheTest(SimpleTestCase):
+    """
+    Two processes are stood in for by two backends with their own L1 (a
+    different KEY_PREFIX) in front of the same locmem L2.
+    """
+
+    def setUp(self):
+        _stores.clear()
+        caches['shared'].clear()
+        self.addCleanup(_stores.clear)
+
+    def process(self, name, stamp_interval=0):
+        return TwoLevelCache('shared', {
+            'KEY_PREFIX': name,
+            'OPTIONS': {'STAMP_INTERVAL': stamp_interval, 'WRITE_ONCE_KEYS': ['list:']},
+        })
+
+    def test_write_reaches_other_process(self):
+        first, second = self.process('first'), self.process('second')
+        first.set('key', 1)
+        self.assertEqual(second.get('key'), 1)
+        first.set('key', 2)
+        self.assertEqual(second.get('key'), 2)
+
+    def test_delete_reaches_other_process(self):
+        first, second = self.process('first'), self.process('second')
+        first.set('key', 1)
+        self.assertEqual(second.get('key'), 1)
+        first.delete('key')
+        self.assertIsNone(second.get('key'))
+
+    def test_other_process_reads_l1_until_stamp_interval(self):
+        first, second = self.process('first'), self.process('second', stamp_interval=60)
+        first.set('key', 1)
+        self.assertEqual(second.get('key'), 1)
+        first.set('key', 2)
+        self.assertEqual(second.get('key'), 1)
+        second.store.checked_at = 0
+        self.assertEqual(second.get('key'), 2)
+
+    def test_write_once_keys_keep_l1_of_other_processes(self):
+        first, second = self.process('first'), self.process('second')
+        first.set('key', 1)
+        self.assertEqual(second.get('key'), 1)
+        stamp = caches['shared'].get(first.stamp_key)
+
+        first.set('list:1', 'rows')
+        first.add('list:1:variants', 0)
+        first.incr('list:1:variants')
+
+        self.assertEqual(caches['shared'].get(first.stamp_key), stamp)
+        self.assertEqual(len(second.store.entries), 1)
+        self.assertEqual(second.get('list:1'), 'rows')
+
+    def test_own_write_keeps_own_l1(self):
+        cache = self.process('first')
+        cache.set('one', 1)
+        cache.set('two', 2)
+        self.assertEqual(len(cache.store.entries), 2)
+        self.assertEqual(cache.stats()['l1'], {'hits': 0, 'misses': 0, 'hit_rate': 0})
+        self.assertEqual(cache.get('one'), 1)
+        self.assertEqual(cache.stats()['l1']['hits'], 1)
+
+
+@override_settings(TIME_ZONE='Europe/Berlin')
+class ComputeNextRunTest(SimpleTestCase):
+
+    def elapsed(self, start, end):
+        # Aware datetimes in the same zone subtract as wall clock time
+        return end.astimezone(dt_timezone.utc) - start.astimezone(dt_timezone.utc)
+
+    def next_after(self, newsletter, number):
+        """The run following the ``number``-th, as seen right after it was sent."""
+        newsletter.last_run_at = newsletter.occurrence(number)
+        return newsletter.compute_next_run(now=newsletter.last_run_at)
+
+    def test_first_run_is_initial(self):
+        initial = datetime(2023, 5, 10, 9, tzinfo=BERLIN)
+        newsletter = Newsletter(initial=initial, frequency='D')
+        self.assertEqual(newsletter.compute_next_run(now=initial - timedelta(hours=1)), initial)
+
+    def test_monthly_from_month_end(self):
+        newsletter = Newsletter(initial=datetime(2023, 1, 31, 10, tzinfo=BERLIN), frequency='M')
+        self.assertEqual(self.next_after(newsletter, 0), datetime(2023, 2, 28, 10, tzinfo=BERLIN))
+        # Counted from initial, so a short month does not pull later runs forward
+        self.assertEqual(self.next_after(newsletter, 1), datetime(2023, 3, 31, 10, tzinfo=BERLIN))
+        self.assertEqual(self.next_after(newsletter, 2), datetime(2023, 4, 30, 10, tzinfo=BERLIN))
+
+    def test_monthly_in_leap_year(self):
+        newsletter = Newsletter(initial=datetime(2024, 1, 31, 10, tzinfo=BERLIN), frequency='M')
+        self.assertEqual(self.next_after(newsletter, 0), datetime(2024, 2, 29, 10, tzinfo=BERLIN))
+
+    def test_daily_keeps_local_time_over_dst_changes(self):
+        spring = Newsletter(initial=datetime(2023, 3, 25, 9, tzinfo=BERLIN), frequency='D')
+        next_run = self.next_after(spring, 0)
+        self.assertEqual(timezone.localtime(next_run).hour, 9)
+        self.assertEqual(self.elapsed(spring.initial, next_run), timedelta(hours=23))
+
+        autumn = Newsletter(initial=datetime(2023, 10, 28, 9, tzinfo=BERLIN), frequency='D')
+        next_run = self.next_after(autumn, 0)
+        self.assertEqual(timezone.localtime(next_run).hour, 9)
+        self.assertEqual(self.elapsed(autumn.initial, next_run), timedelta(hours=25))
+
+    def test_weekly_over_dst_change(self):
+        newsletter = Newsletter(initial=datetime(2023, 3, 20, 9, tzinfo=BERLIN), frequency='W')
+        self.assertEqual(self.next_after(newsletter, 0), datetime(2023, 3, 27, 9, tzinfo=BERLIN))
+
+    def test_missed_runs_are_skipped(self):
+        newsletter = Newsletter(initial=datetime(2023, 5, 1, 9, tzinfo=BERLIN), frequency='D')
+        now = datetime(2023, 5, 10, 12, tzinfo=BERLIN)
+        self.assertEqual(newsletter.compute_next_run(now=now), datetime(2023, 5, 11, 9, tzinfo=BERLIN))
+
+    def test_none_past_end_date_or_when_finished(self):
+        initial = datetime(2023, 5, 1, 9, tzinfo=BERLIN)
+        newsletter = Newsletter(initial=initial, frequency='W', end_date=initial + timedelta(days=3))
+        self.assertIsNone(self.next_after(newsletter, 0))
+        newsletter = Newsletter(initial=initial, frequency='W', finished=True)
+        self.assertIsNone(newsletter.compute_next_run(now=initial))
+
+
+class AttemptBufferTest(TestCase):
+
+    def setUp(self):
+        message = Message.objects.create(topic='Тема', content='Текст')
+        self.newsletter = Newsletter.objects.create(initial=timezone.now() + timedelta(days=1), message=message)
+        self.newsletter.clients.set(Client.objects.bulk_create(
+            Client(email=f'client{i}@example.com', comment='') for i in range(3)
+        ))
+        self.recipients = list(iter_recipients(self.newsletter))
+
+    def statuses(self):
+        return list(Attempt.objects.order_by('client_id').values_list('last_attempt_status', flat=True))
+
+    def test_outcomes_are_written_in_batches(self):
+        with AttemptBuffer(self.newsletter, batch_size=2, flush_interval=3600) as buffer:
+            items = list(zip(buffer.claim(self.recipients), self.recipients))
+            self.assertEqual(self.statuses(), ['P', 'P', 'P'])
+            for item in items[:2]:
+                buffer.record(item, None)
+            self.assertEqual(self.statuses(), ['S', 'S', 'P'])
+            buffer.record(items[2], None)
+            self.assertEqual(self.statuses(), ['S', 'S', 'P'])
+        self.assertEqual(self.statuses(), ['S', 'S', 'S'])
+        self.assertEqual(buffer.written, 3)
+
+    def test_only_transient_failures_are_retried(self):
+        with AttemptBuffer(self.newsletter) as buffer:
+            transient, permanent, _ = zip(buffer.claim(self.recipients), self.recipients)
+            buffer.record(transient, smtplib.SMTPServerDisconnected('gone'))
+            buffer.record(permanent, smtplib.SMTPRecipientsRefused({permanent[1].email: (550, b'no such user')}))
+
+        attempts = list(Attempt.objects.order_by('client_id')[:2])
+        self.assertEqual([attempt.last_attempt_status for attempt in attempts], ['F', 'F'])
+        self.assertEqual([attempt.server_response for attempt in attempts], [0, 550])
+        self.assertEqual(attempts[0].next_retry_at, buffer.next_retry_at)
+        self.assertIsNotNone(buffer.next_retry_at)
+        self.assertIsNone(attempts[1].next_retry_at)
+
+
+class ResumableRunTest(TestCase):
+    """Checkpoints of a run and the one claim per client and run that makes it safe to resume."""
+
+    def setUp(self):
+        message = Message.objects.create(topic='Тема', content='Текст')
+        self.newsletter = Newsletter.objects.create(initial=timezone.now() + timedelta(days=1), message=message)
+        clients = Client.objects.bulk_create(
+            Client(email=f'client{i}@example.com', comment='') for i in range(3)
+        )
+        self.newsletter.clients.set(clients)
+        self.clients = sorted(client.pk for client in clients)
+
+    def recipients(self, after_id=None):
+        return list(iter_recipients(self.newsletter, after_id))
+
+    def test_resume_after_claimed_clients(self):
+        with AttemptBuffer(self.newsletter) as buffer:
+            for attempt in buffer.claim(self.recipients()[:2]):
+                buffer.mark_sending(attempt)
+
+        after_id = last_claimed_client(self.newsletter)
+        self.assertEqual(after_id, self.clients[1])
+        self.assertEqual([recipient.id for recipient in self.recipients(after_id)], self.clients[2:])
+
+    def test_unsent_claims_are_released_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with AttemptBuffer(self.newsletter) as buffer:
+                attempts = buffer.claim(self.recipients())
+                buffer.mark_sending(attempts[0])
+                raise RuntimeError
+
+        self.assertEqual(last_claimed_client(self.newsletter), self.clients[0])
+        self.assertEqual(Attempt.objects.filter(newsletter=self.newsletter).count(), 1)
+
+    def test_second_claim_of_a_run_is_duplicate(self):
+        AttemptBuffer(self.newsletter).claim(self.recipients())
+        with self.assertRaises(DuplicateRun):
+            AttemptBuffer(self.newsletter).claim(self.recipients()[:1])
+
+    def test_next_run_claims_again(self):
+        AttemptBuffer(self.newsletter).claim(self.recipients())
+        self.newsletter.run += 1
+        self.assertIsNone(last_claimed_client(self.newsletter))
+        self.assertEqual(len(AttemptBuffer(self.newsletter).claim(self.recipients())), 3)
+
+    def test_run_status_is_written_alone(self):
+        Newsletter.objects.filter(pk=self.newsletter.pk).update(send_window=30)
+        set_run_status(self.newsletter, 'S')
+        newsletter = Newsletter.objects.get(pk=self.newsletter.pk)
+        self.assertEqual((newsletter.status, newsletter.send_window), ('S', 30))
+
+    def test_run_status_of_a_superseded_run_is_dropped(self):
+        Newsletter.objects.filter(pk=self.newsletter.pk).update(run=2, status='P')
+        set_run_status(self.newsletter, 'F')
+        self.assertEqual(Newsletter.objects.get(pk=self.newsletter.pk).status, 'P')
+
+
+class PickFairTest(SimpleTestCase):
+
+    def tasks(self, *owners):
+        return [SimpleNamespace(id=number, owner_id=owner) for number, owner in enumerate(owners)]
+
+    def test_owners_take_turns(self):
+        candidates = self.tasks('a', 'a', 'a', 'b', 'c')
+        picked = pick_fair(candidates, {}, 4, per_owner=0)
+        self.assertEqual([task.owner_id for task in picked], ['a', 'b', 'c', 'a'])
+
+    def test_owner_cap_counts_running_tasks(self):
+        candidates = self.tasks('a', 'a', 'a', 'b')
+        running = {'a': 1}
+        picked = pick_fair(candidates, running, 10, per_owner=2)
+        self.assertEqual([task.owner_id for task in picked], ['a', 'b'])
+        self.assertEqual(running, {'a': 2, 'b': 1})
+
+    def test_owner_at_cap_gets_nothing(self):
+        picked = pick_fair(self.tasks('a', 'b'), {'a': 2}, 10, per_owner=2)
+        self.assertEqual([task.owner_id for task in picked], ['b'])
+
+
+class FairShareTest(SimpleTestCase):
+
+    def test_paused_turn_lets_other_owners_send(self):
+        share = FairShare(slots=1)
+        paused, resumed = threading.Event(), threading.Event()
+        order = []
+
+        def throttled():
+            with share.turn('a') as turn:
+                with turn.paused():
+                    paused.set()
+                    resumed.wait(5)
+                order.append('a')
+
+        thread = threading.Thread(target=throttled)
+        thread.start()
+        paused.wait(5)
+        with share.turn('b'):
+            order.append('b')
+        resumed.set()
+        thread.join(5)
+        self.assertEqual(order, ['b', 'a'])
+        self.assertEqual(share.busy, 0)
+
+
+@override_settings(CACHES=TWO_LEVEL_CACHES)
+@mock.patch('newsletter.ratelimit.is_shared', return_value=True)
+@mock.patch('time.time', return_value=NOW)
+class SendQuotaTest(SimpleTestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.quota = SendQuota(cache_alias='shared')
+
+    def test_hourly_quota(self, *mocks):
+        self.assertEqual(self.quota.take(1, 8, per_hour=10), (8, None))
+        self.assertEqual(self.quota.take(1, 5, per_hour=10), (2, NOW - 100 + HOUR))
+        self.assertEqual(self.quota.take(1, 1, per_hour=10), (0, NOW - 100 + HOUR))
+
+    def test_owners_have_quotas_of_their_own(self, *mocks):
+        self.quota.take(1, 10, per_hour=10)
+        self.assertEqual(self.quota.take(2, 10, per_hour=10), (10, None))
+
+    def test_daily_quota_gives_back_to_hourly(self, *mocks):
+        granted, resume_at = self.quota.take(1, 8, per_hour=10, per_day=5)
+        self.assertEqual((granted, resume_at), (5, (NOW // DAY + 1) * DAY))
+        # Only the 5 granted count against the hour
+        self.assertEqual(self.quota.take(1, 10, per_hour=10), (5, NOW - 100 + HOUR))
+
+    def test_resumes_when_the_exhausted_quota_starts_over(self, *mocks):
+        self.quota.take(1, 10, per_hour=10, per_day=10)
+        self.assertEqual(self.quota.take(1, 1, per_hour=10, per_day=10), (0, NOW - 100 + HOUR))
+        self.quota.take(2, 5, per_hour=10, per_day=8)
+        self.assertEqual(self.quota.take(2, 5, per_hour=10, per_day=8), (3, (NOW // DAY + 1) * DAY))
+
+
+@mock.patch('newsletter.scheduler.send_newsletter', return_value=0)
+class RunTaskTest(TestCase):
+    """Booking of send occurrences; the sending itself is left out."""
+
+    def setUp(self):
+        message = Message.objects.create(topic='Тема', content='Текст')
+        self.newsletter = Newsletter.objects.create(
+            initial=timezone.now() - timedelta(days=2, minutes=1), frequency='D', message=message
+        )
+        Newsletter.objects.filter(pk=self.newsletter.pk).update(status='S')
+        self.due_at = self.newsletter.occurrence(2)
+
+    def claim(self, due_at, attempts=1):
+        task = DispatchTask.objects.get(newsletter=self.newsletter, kind=SEND, state='W')
+        now = timezone.now()
+        DispatchTask.objects.filter(pk=task.pk).update(
+            due_at=due_at, state='R', locked_by='test', locked_at=now, heartbeat_at=now, attempts=attempts
+        )
+        return DispatchTask.objects.get(pk=task.pk)
+
+    def waiting(self):
+        return list(DispatchTask.objects.filter(newsletter=self.newsletter, kind=SEND, state='W')
+                    .values_list('due_at', flat=True))
+
+    def test_send_starts_a_run_and_queues_the_following(self, send):
+        run_task.__wrapped__(self.claim(self.due_at))
+        send.assert_called_once()
+        newsletter = Newsletter.objects.get(pk=self.newsletter.pk)
+        self.assertEqual((newsletter.run, newsletter.status, newsletter.last_run_at), (2, 'P', self.due_at))
+        self.assertEqual(self.waiting(), [self.newsletter.occurrence(3)])
+
+    def test_misfire_books_the_occurrence_without_a_run(self, send):
+        due_at = self.newsletter.occurrence(1)
+        task = self.claim(due_at)
+        run_task.__wrapped__(task)
+        send.assert_not_called()
+        newsletter = Newsletter.objects.get(pk=self.newsletter.pk)
+        self.assertEqual((newsletter.run, newsletter.status, newsletter.last_run_at), (1, 'S', due_at))
+        self.assertEqual(DispatchTask.objects.get(pk=task.pk).state, 'M')
+        # Today's occurrence is still within the grace period
+        self.assertEqual(self.waiting(), [self.due_at])
+
+    def test_newsletter_finished_after_the_claim_is_not_sent(self, send):
+        task = self.claim(self.due_at)
+        Newsletter.objects.filter(pk=self.newsletter.pk).update(finished=True)
+        run_task.__wrapped__(task)
+        send.assert_not_called()
+        newsletter = Newsletter.objects.get(pk=self.newsletter.pk)
+        self.assertEqual((newsletter.run, newsletter.status), (1, 'S'))
+        self.assertEqual(self.waiting(), [])
+
+    def test_takeover_resumes_the_run_and_queues_the_following(self, send):
+        task = self.claim(self.due_at, attempts=2)
+        # The first worker booked the occurrence and died before queueing the following one
+        Newsletter.objects.filter(pk=self.newsletter.pk).update(
+            last_run_at=self.due_at, run=2, status='P', run_started_at=self.due_at + timedelta(seconds=1)
+        )
+        run_task.__wrapped__(task)
+        send.assert_called_once()
+        self.assertEqual(Newsletter.objects.get(pk=self.newsletter.pk).run, 2)
+        self.assertEqual(self.waiting(), [self.newsletter.occurrence(3)])
+
+    def test_takeover_of_a_finished_run_does_not_send_again(self, send):
+        task = self.claim(self.due_at, attempts=2)
+        Newsletter.objects.filter(pk=self.newsletter.pk).update(
+            last_run_at=self.due_at, run=2, status='S', run_started_at=self.due_at + timedelta(seconds=1)
+        )
+        run_task.__wrapped__(task)
+        send.assert_not_called()
+        self.assertEqual(Newsletter.objects.get(pk=self.newsletter.pk).run, 2)
+
+
+class NewsletterSaveTest(TestCase):
+
+    def setUp(self):
+        self.message = Message.objects.create(topic='Тема', content='Текст')
+        self.newsletter = Newsletter.objects.create(
+            initial=timezone.now() + timedelta(days=1), frequency='D', message=self.message
+        )
+
+    def start_run(self):
+        """What the scheduler writes while a loaded instance is being edited."""
+        started_at = timezone.now()
+        Newsletter.objects.filter(pk=self.newsletter.pk).update(
+            run=F('run') + 1, status='P', last_run_at=started_at, run_started_at=started_at
+        )
+        return Newsletter.objects.values('run', 'status', 'last_run_at', 'run_started_at').get(pk=self.newsletter.pk)
+
+    def test_save_leaves_scheduler_fields_alone(self):
+        booked = self.start_run()
+        self.newsletter.send_window = 30
+        self.newsletter.save()
+        self.assertEqual(Newsletter.objects.values(*booked).get(pk=self.newsletter.pk), booked)
+
+    def test_schedule_change_leaves_scheduler_fields_alone(self):
+        booked = self.start_run()
+        self.newsletter.initial += timedelta(hours=1)
+        self.newsletter.finished = True
+        self.newsletter.save()
+        self.assertEqual(Newsletter.objects.values(*booked).get(pk=self.newsletter.pk), booked)
+        self.assertTrue(Newsletter.objects.get(pk=self.newsletter.pk).finished)
+
+    def test_bulk_reschedule(self):
+        other = Newsletter.objects.create(initial=timezone.now() + timedelta(days=1), frequency='W',
+                                          message=self.message)
+        initial = timezone.now() + timedelta(days=3)
+        newsletters = Newsletter.objects.filter(pk__in=[self.newsletter.pk, other.pk])
+        newsletters.update(initial=initial)
+        Newsletter.objects.filter(pk=other.pk).update(finished=True)
+
+        self.assertEqual(newsletters.reschedule(), 2)
+        waiting = DispatchTask.objects.filter(kind=SEND, state='W')
+        self.assertEqual(list(waiting.values_list('newsletter_id', 'due_at')), [(self.newsletter.pk, initial)])
+
+
+class Clock:
+    """Stands in for time.time() and time.sleep(), sleeping in fake time."""
+
+    def __init__(self, now):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@override_settings(CACHES=TWO_LEVEL_CACHES)
+class RateLimiterTest(SimpleTestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.clock = Clock(NOW + 0.25)
+        for name in ('time', 'sleep'):
+            patcher = mock.patch(f'time.{name}', getattr(self.clock, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def limiter(self, **limits):
+        options = {'per_second': 0, 'per_hour': 0, 'domain_per_second': 0, 'domain_per_hour': 0, 'domain_rates': {}}
+        options.update(limits)
+        return RateLimiter(cache_alias='shared', **options)
+
+    def count(self, scope, period):
+        return caches['shared'].get(f'newsletter-rate:{scope}:{period}:{int(self.clock.now // period)}')
+
+    def test_budget_is_taken_until_spent(self):
+        limiter = self.limiter(per_second=2)
+        self.assertEqual(limiter.reserve('a.test'), 0)
+        self.assertEqual(limiter.reserve('a.test'), 0)
+        self.assertEqual(limiter.reserve('a.test'), 0.75)
+        self.assertEqual(self.count('all', SECOND), 2)
+
+    def test_spent_domain_gives_back_the_global_budget(self):
+        limiter = self.limiter(per_second=10, domain_rates={'slow.test': (1, 0)})
+        self.assertEqual(limiter.reserve('slow.test'), 0)
+        self.assertEqual(limiter.reserve('slow.test'), 0.75)
+        self.assertEqual(self.count('all', SECOND), 1)
+        self.assertEqual(self.count('slow.test', SECOND), 1)
+        self.assertEqual(limiter.reserve('fast.test'), 0)
+
+    def test_hourly_budget(self):
+        limiter = self.limiter(domain_per_hour=1)
+        self.assertEqual(limiter.reserve('a.test'), 0)
+        self.assertEqual(limiter.reserve('a.test'), HOUR - 100.25)
+        self.assertEqual(limiter.reserve('b.test'), 0)
+
+    def test_acquire_sleeps_into_the_next_slot(self):
+        limiter = self.limiter(per_second=1)
+        self.assertEqual(limiter.acquire('a.test'), 0)
+        self.assertEqual(limiter.acquire('a.test'), 0.75)
+        self.assertEqual(self.clock.slept, [0.75])
+        self.assertEqual(self.count('all', SECOND), 1)
+
+    def test_slot_expiring_between_add_and_incr(self):
+        limiter = self.limiter(per_second=1)
+        cache = caches['shared']
+        add = cache.add
+        expired = []
+
+        def expiring_add(key, *args, **kwargs):
+            added = add(key, *args, **kwargs)
+            if not expired:
+                expired.append(key)
+                cache.delete(key)
+            return added
+
+        with mock.patch.object(cache, 'add', expiring_add):
+            self.assertEqual(limiter.reserve('a.test'), 0)
+        self.assertEqual(expired, [f'newsletter-rate:all:{SECOND}:{int(self.clock.now)}'])
+        self.assertEqual(self.count('all', SECOND), 1)
+
+
+class ShardingTest(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create(email='owner@example.com')
+        self.message = Message.objects.create(topic='Тема', content='Текст')
+        self.newsletter = self.sharded(self.owner, 5)
+
+    def sharded(self, owner, clients):
+        newsletter = Newsletter.objects.create(initial=timezone.now() + timedelta(days=1), message=self.message,
+                                               user=owner)
+        newsletter.clients.set(Client.objects.bulk_create(
+            Client(email=f'client{i}@example.com', comment='') for i in range(clients)
+        ))
+        plan_shards(newsletter, shard_size=2)
+        return newsletter
+
+    def shards(self, newsletter=None):
+        return Shard.objects.filter(newsletter=newsletter or self.newsletter).order_by('first_client_id')
+
+    def status(self):
+        return Newsletter.objects.get(pk=self.newsletter.pk).status
+
+    def test_plan_splits_the_run_once(self):
+        self.assertEqual([shard.size for shard in self.shards()], [2, 2, 1])
+        self.assertTrue(plan_shards(self.newsletter, shard_size=2))
+        self.assertEqual(self.shards().count(), 3)
+
+    def test_small_run_is_not_sharded(self):
+        small = self.sharded(self.owner, 2)
+        self.assertFalse(self.shards(small).exists())
+
+    def test_run_status_waits_for_every_shard(self):
+        self.shards().filter(pk=self.shards()[0].pk).update(state='S')
+        finish_run(self.newsletter.id, 1)
+        self.assertEqual(self.status(), 'P')
+
+    def test_cancelled_beats_failed_beats_successful(self):
+        for states, status in ((('S', 'S', 'S'), 'S'), (('S', 'F', 'S'), 'F'), (('F', 'C', 'S'), 'C')):
+            for shard, state in zip(self.shards(), states):
+                Shard.objects.filter(pk=shard.pk).update(state=state)
+            finish_run(self.newsletter.id, 1)
+            self.assertEqual(self.status(), status)
+
+    def test_superseded_run_is_left_alone(self):
+        Newsletter.objects.filter(pk=self.newsletter.pk).update(run=2)
+        self.assertIsNone(claim_shard('worker'))
+        self.shards().update(state='S')
+        finish_run(self.newsletter.id, 1)
+        self.assertEqual(self.status(), 'P')
+
+    def test_claim_takes_over_stale_shards(self):
+        first = claim_shard('first')
+        self.assertEqual(first.claimed_by, 'first')
+        self.assertNotEqual(claim_shard('second').pk, first.pk)
+        Shard.objects.filter(pk=first.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(claim_shard('third').pk, first.pk)
+
+    @mock.patch('newsletter.sharding.deliver_newsletter')
+    def test_quota_defers_the_owners_shards(self, deliver):
+        other = self.sharded(User.objects.create(email='other@example.com'), 3)
+        resume_at = timezone.now() + timedelta(hours=1)
+        deliver.side_effect = QuotaExceeded('quota', resume_at)
+
+        shard = claim_shard('worker', self.newsletter.id)
+        with self.assertRaises(QuotaExceeded):
+            process_shard(shard, 'worker')
+
+        self.assertEqual(set(self.shards().values_list('state', 'not_before')), {('W', resume_at)})
+        self.assertEqual(list(self.shards(other).values_list('not_before', flat=True)), [None, None])
+        self.assertEqual(claim_shard('worker').newsletter_id, other.id)
+        self.assertEqual(self.status(), 'P')
+
+    @mock.patch('newsletter.sharding.deliver_newsletter')
+    def test_shard_outcomes_finish_the_run(self, deliver):
+        deliver.side_effect = [None, RunCancelled('cancelled'), RuntimeError('smtp')]
+        while (shard := claim_shard('worker')) is not None:
+            process_shard(shard, 'worker')
+        self.assertEqual(list(self.shards().values_list('state', flat=True)), ['S', 'C', 'F'])
+        self.assertEqual(self.status(), 'C')
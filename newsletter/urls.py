@@ -4,7 +4,7 @@ from django.urls import path
 from newsletter.views import NewsletterListView, NewsletterDetailView, NewsletterCreateView, NewsletterUpdateView, \
     NewsletterDeleteView, ClientCreateView, ClientDetailView, ClientUpdateView, ClientDeleteView, MessageDetailView, \
     MessageCreateView, MessageUpdateView, MessageDeleteView, ClientListView, MessageListView, AttemptListView, \
-    NewsletterFinishView
+    NewsletterFinishView, MetricsView
 
 app_name = 'newsletter'
 
@@ -32,5 +32,6 @@ urlpatterns = [
     # Other
     path('attempts/', AttemptListView.as_view(), name='attempt_list'),
     path('newsletter_finish/<int:pk>/', NewsletterFinishView.as_view(), name='newsletter_finish'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 
 ]
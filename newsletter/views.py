@@ -1,15 +1,16 @@
-from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 from django.core.exceptions import PermissionDenied
-import random
+from django.http import HttpResponse
 from django.urls import reverse_lazy
-from django.utils import timezone
-from django.views.generic import ListView, DetailView, TemplateView, CreateView, UpdateView, DeleteView
+from django.views.generic import ListView, DetailView, TemplateView, CreateView, UpdateView, DeleteView, View
 
-from blog.models import Post
+from blog.services import sample_posts
 from newsletter.forms import NewsletterForm, ClientForm, MessageForm, NewsletterFinishForm
+from newsletter.metrics import registry, CONTENT_TYPE
 from newsletter.models import Newsletter, Client, Message, Attempt
 import logging
-from newsletter.services import get_newsletters_from_cache
+from newsletter.services import get_newsletters_from_cache, get_newsletter_cards, get_anonymous_page
+from newsletter.stats import get_stats, NEWSLETTERS, ACTIVE_NEWSLETTERS, CLIENTS
 
 logger = logging.getLogger(__name__)
 
@@ -38,33 +39,32 @@ class ContactsTemplateView(LoginRequiredMixin, TemplateView):
 
 class NewsletterListView(ListView):
     model = Newsletter
-    template_name = 'newsletter/main_page.html'
+    template_name = 'newsletter/newsletter_list.html'
     context_object_name = 'newsletters'
 
+    def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+
+        def render():
+            return super(NewsletterListView, self).get(request, *args, **kwargs).render().content
+
+        return HttpResponse(get_anonymous_page(render))
+
     def get_queryset(self):
         return get_newsletters_from_cache()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        now = timezone.now()
-
-        total_newsletters = Newsletter.objects.count()
-
-        active_newsletters = Newsletter.objects.filter(
-            initial__lte=now,
-            end_date__gte=now,
-            finished=False
-        ).count()
-
-        unique_clients = Client.objects.distinct().count()
+        context['newsletter_cards'] = get_newsletter_cards(self.request.user)
+        stats = get_stats()
 
-        all_posts = list(Post.objects.all())
-        random_posts = random.sample(all_posts, min(len(all_posts), 3))
+        random_posts = sample_posts(3)
 
         context.update({
-            'total_newsletters': total_newsletters,
-            'active_newsletters': active_newsletters,
-            'unique_clients': unique_clients,
+            'total_newsletters': stats[NEWSLETTERS],
+            'active_newsletters': stats[ACTIVE_NEWSLETTERS],
+            'unique_clients': stats[CLIENTS],
             'random_posts': random_posts
         })
 
@@ -78,10 +78,7 @@ class NewsletterCreateView(LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('newsletter:newsletter_list')
 
     def form_valid(self, form):
-        newsletter = form.save()
-        user = self.request.user
-        newsletter.user = user
-        newsletter.save()
+        form.instance.user = self.request.user
         return super().form_valid(form)
 
     def get_form(self, form_class=None):
@@ -251,4 +248,18 @@ class NewsletterFinishView(PermissionRequiredMixin, UpdateView):
     form_class = NewsletterFinishForm
     template_name = 'newsletter/newsletter_finish_form.html'
     success_url = reverse_lazy('newsletter:newsletter_list')
-    permission_required = 'newsletter.can_turn_the_newsletter_off'
\ No newline at end of file
+    permission_required = 'newsletter.can_turn_the_newsletter_off'
+
+
+class MetricsView(UserPassesTestMixin, View):
+    """
+    Metrics of this web process (cache lookups, mail lanes) in the
+    Prometheus text format; the scheduler serves its own on its metrics port.
+    """
+    raise_exception = True
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
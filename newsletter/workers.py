@@ -0,0 +1,169 @@
+import logging
+import queue
+import threading
+import time
+
+from config.settings import NEWSLETTER_WORKERS, NEWSLETTER_QUEUE_SIZE, NEWSLETTER_DOMAIN_CONCURRENCY
+from newsletter.mailer import Mailer, recipient_domain
+from newsletter.ratelimit import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class SerialSender:
+    """Sends every message inline on the calling thread over one Mailer."""
+
+    def __init__(self, limiter=rate_limiter):
+        self.mailer = Mailer(limiter=limiter)
+        self._results = []
+
+    def __enter__(self):
+        self.mailer.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.mailer.__exit__(exc_type, exc_value, traceback)
+
+    def submit(self, item, message):
+        try:
+            self.mailer.send(message)
+            self._results.append((item, None))
+        except Exception as e:
+            self._results.append((item, e))
+
+    def completed(self):
+        results, self._results = self._results, []
+        return results
+
+    def drain(self):
+        return self.completed()
+
+    @property
+    def sent(self):
+        return self.mailer.sent
+
+    @property
+    def elapsed(self):
+        return self.mailer.elapsed
+
+    @property
+    def rate(self):
+        return self.mailer.rate
+
+
+class DeliveryPool:
+    """
+    Sends messages from a pool of worker threads, each holding its own
+    persistent Mailer connection.
+
+    Messages are handed to the workers through a bounded queue, so the
+    producer blocks instead of buffering the whole recipient list. Results
+    come back through ``completed()`` to the single thread that owns the
+    pool, which is the only one writing to the database. ``domain_limit``
+    caps how many workers may talk to the same recipient domain at once.
+    ``drain()`` waits until every submitted message has its result.
+    """
+
+    def __init__(self, workers=NEWSLETTER_WORKERS, queue_size=NEWSLETTER_QUEUE_SIZE,
+                 domain_limit=NEWSLETTER_DOMAIN_CONCURRENCY, limiter=rate_limiter):
+        self.workers = workers
+        self.domain_limit = domain_limit
+        self.limiter = limiter
+        self.pending = 0
+        self.tasks = queue.Queue(maxsize=queue_size)
+        self.results = queue.SimpleQueue()
+        self.started_at = None
+        self._threads = []
+        self._mailers = []
+        self._domain_slots = {}
+        self._lock = threading.Lock()
+        self._aborted = threading.Event()
+
+    def __enter__(self):
+        self.started_at = time.monotonic()
+        for number in range(self.workers):
+            mailer = Mailer(limiter=self.limiter)
+            thread = threading.Thread(
+                target=self._work, args=(mailer,), name=f'newsletter-worker-{number}', daemon=True
+            )
+            self._mailers.append(mailer)
+            self._threads.append(thread)
+            thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._aborted.set()
+        for _ in self._threads:
+            self.tasks.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, item, message):
+        self.tasks.put((item, message))
+        self.pending += 1
+
+    def completed(self):
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                self.pending -= len(results)
+                return results
+
+    def drain(self):
+        results = []
+        while self.pending:
+            results.append(self.results.get())
+            self.pending -= 1
+        return results
+
+    def _domain_slot(self, domain):
+        with self._lock:
+            slot = self._domain_slots.get(domain)
+            if slot is None:
+                slot = self._domain_slots[domain] = threading.BoundedSemaphore(self.domain_limit)
+            return slot
+
+    def _work(self, mailer):
+        with mailer:
+            while True:
+                task = self.tasks.get()
+                if task is _STOP:
+                    return
+                if self._aborted.is_set():
+                    continue
+                item, message = task
+                try:
+                    if self.domain_limit:
+                        with self._domain_slot(recipient_domain(message)):
+                            mailer.send(message)
+                    else:
+                        mailer.send(message)
+                    self.results.put((item, None))
+                except Exception as e:
+                    self.results.put((item, e))
+
+    @property
+    def sent(self):
+        return sum(mailer.sent for mailer in self._mailers)
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return time.monotonic() - self.started_at
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed else 0.0
+
+
+def get_sender(workers=NEWSLETTER_WORKERS, limiter=rate_limiter):
+    if workers > 1:
+        return DeliveryPool(workers=workers, limiter=limiter)
+    return SerialSender(limiter=limiter)
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_alter_user_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='send_quota_day',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='писем в сутки'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='send_quota_hour',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='писем в час'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='send_weight',
+            field=models.PositiveSmallIntegerField(default=1, verbose_name='вес при отправке'),
+        ),
+    ]
@@ -12,6 +12,10 @@ class User(AbstractUser):
 
     token = models.CharField(max_length=100, verbose_name='token', null=True, blank=True)
 
+    send_weight = models.PositiveSmallIntegerField(default=1, verbose_name='вес при отправке')
+    send_quota_hour = models.PositiveIntegerField(verbose_name='писем в час', null=True, blank=True)
+    send_quota_day = models.PositiveIntegerField(verbose_name='писем в сутки', null=True, blank=True)
+
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
 
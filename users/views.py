@@ -4,13 +4,13 @@ import string
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.contrib.auth.views import PasswordResetView
-from django.core.mail import send_mail
 from django.http import HttpResponseRedirect, request
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy, reverse
 from django.views.generic import CreateView, ListView, View, TemplateView
 from django.contrib import messages
 from config.settings import EMAIL_HOST_USER, DEFAULT_FROM_EMAIL
+from newsletter.lanes import send_priority_mail
 from users.forms import UserRegisterForm, RecoveryForm
 from users.models import User
 
@@ -29,7 +29,7 @@ class RegisterView(CreateView):
         user.save()
         host = self.request.get_host()
         url = f'http://{host}/users/email_confirmation/{token}/'
-        send_mail(
+        send_priority_mail(
             subject='Подтверждение почты',
             message=f'Перейдите по ссылке для подтверждения почты {url}',
             from_email=EMAIL_HOST_USER,
@@ -57,16 +57,22 @@ class UserResetPasswordView(PasswordResetView):
             user = User.objects.get(email=email)
             character = string.ascii_letters + string.digits
             password = "".join(secrets.choice(character) for i in range(12))
-            user.set_password(password)
-            user.save()
-            send_mail(
+            # The new password is only saved once the mail with it is sent,
+            # so a lost mail cannot lock the user out
+            sent = send_priority_mail(
                 subject="Восстановление пароля",
                 message=f"Ваш пароль от сайта News.com изменен:\n"
                         f"Email: {email}\n"
                         f"Пароль: {password}",
                 from_email=DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email]
+                recipient_list=[user.email],
+                wait=True
             )
+            if not sent:
+                form.add_error(None, 'Не удалось отправить письмо, попробуйте позже')
+                return self.form_invalid(form)
+            user.set_password(password)
+            user.save()
             return HttpResponseRedirect(self.get_success_url())
         else:
             return HttpResponseRedirect(reverse('users:registration'))